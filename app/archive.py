@@ -0,0 +1,49 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from . import db, metrics
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@metrics.timed(metrics.TASK_SECONDS, task="archiver")
+async def archive_invoices() -> int:
+    """Move finished invoices past the retention age to the archive, one small batch at a time.
+
+    Each batch is its own short write transaction so payment handling is never
+    blocked for long behind the archiver.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=settings.invoice_archive_after_days)
+    total = 0
+    while True:
+        moved = await db.archive_finished_invoices(cutoff, settings.invoice_archive_batch_size)
+        total += moved
+        if moved < settings.invoice_archive_batch_size:
+            break
+        await asyncio.sleep(settings.invoice_archive_pause_sec)
+    if total:
+        logger.info("Archived %s finished invoices", total)
+    return total
+
+
+async def compact_database() -> None:
+    """Release free pages left by archiving in small incremental_vacuum steps.
+
+    An older file is first switched to incremental auto-vacuum once.
+    """
+    if await db.enable_incremental_vacuum():
+        return
+    while await db.incremental_vacuum(settings.db_vacuum_pages) > 0:
+        await asyncio.sleep(settings.invoice_archive_pause_sec)
+
+
+async def maintenance_loop() -> None:
+    while True:
+        try:
+            await archive_invoices()
+            await compact_database()
+        except Exception:  # noqa: BLE001
+            logger.exception("Error during database maintenance")
+        await asyncio.sleep(settings.db_maintenance_interval_sec)
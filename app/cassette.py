@@ -0,0 +1,191 @@
+"""Record and replay upstream HTTP traffic.
+
+A cassette is a JSON Lines file (gzip-compressed when the name ends in
+``.gz``) with one exchange per line: upstream, method, path, query, body,
+status, latency and decoded response, plus the wall-clock time of the
+exchange and its offset from the start of the recording. Request headers are
+never written, so API keys stay out of cassettes.
+"""
+import asyncio
+import gzip
+import json
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import IO, Any, Deque, Dict, Optional, Tuple
+
+import aiohttp
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+OFF = "off"
+RECORD = "record"
+REPLAY = "replay"
+
+Key = Tuple[str, str, str, str, str]
+
+
+class CassetteMiss(aiohttp.ClientError):
+    """Raised in replay mode for a request the cassette has no answer for."""
+
+
+def _canonical(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, dict):
+        value = {k: str(v) if not isinstance(v, (dict, list)) else v for k, v in value.items()}
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def _key(upstream: str, method: str, path: str, params: Any, body: Any) -> Key:
+    return (upstream, method.upper(), path, _canonical(params), _canonical(body))
+
+
+def _open(path: str, mode: str) -> IO[str]:
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")  # type: ignore[return-value]
+    return open(path, mode, encoding="utf-8")
+
+
+class _Recorder:
+    def __init__(self, path: str) -> None:
+        self._fh = _open(path, "a")
+        self._started = time.monotonic()
+
+    def write(self, key: Key, status: int, latency: float, response: Any) -> None:
+        upstream, method, path, query, body = key
+        entry = {
+            "t": round(time.monotonic() - self._started, 4),
+            "w": int(time.time() * 1000),
+            "u": upstream,
+            "m": method,
+            "p": path,
+            "q": query,
+            "b": body,
+            "s": status,
+            "d": round(latency, 4),
+            "r": response,
+        }
+        self._fh.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+class _Player:
+    """Serve recorded exchanges in the order they were recorded.
+
+    A request is answered from recordings with the same query and body first,
+    then from any recording of the same path, since cursors and timestamps in
+    the query drift between runs. Once every recording for a request has been
+    served the last one is repeated, so polling loops keep running past the
+    end of the cassette.
+
+    With recorded timing a response is held until its recorded offset from
+    the start of the recording has passed since the player was opened, and
+    for at least its recorded latency, so traffic arrives at the recorded pace.
+    """
+
+    def __init__(self, path: str, recorded_timing: bool) -> None:
+        self._entries: Dict[Tuple[str, ...], Deque[dict]] = {}
+        self._last: Dict[Tuple[str, ...], dict] = {}
+        self._recorded_timing = recorded_timing
+        self._began = time.monotonic()
+        self.started_at_ms: Optional[int] = None
+        count = 0
+        with _open(path, "r") as fh:
+            for line in fh:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                key = (entry["u"], entry["m"], entry["p"], entry["q"], entry["b"])
+                self._entries.setdefault(key, deque()).append(entry)
+                self._entries.setdefault(key[:3], deque()).append(entry)
+                if "w" in entry:
+                    started = entry["w"] - int(entry["t"] * 1000)
+                    if self.started_at_ms is None or started < self.started_at_ms:
+                        self.started_at_ms = started
+                count += 1
+        logger.info("Loaded %s recorded exchanges from %s", count, path)
+
+    def _next(self, key: Tuple[str, ...]) -> Optional[dict]:
+        queue = self._entries.get(key)
+        if queue:
+            self._last[key] = queue.popleft()
+        return self._last.get(key)
+
+    async def play(self, key: Key, url: str) -> Any:
+        entry = self._next(key) or self._next(key[:3])
+        if entry is None:
+            raise CassetteMiss(f"No recorded response for {key[1]} {key[2]} ({key[0]})")
+
+        if self._recorded_timing:
+            delay = max(entry["d"], self._began + entry["t"] - time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if entry["s"] >= 400:
+            request_url = URL(url)
+            raise aiohttp.ClientResponseError(
+                aiohttp.RequestInfo(request_url, key[1], CIMultiDictProxy(CIMultiDict()), request_url),
+                (),
+                status=entry["s"],
+                message="recorded error",
+            )
+        return entry["r"]
+
+
+_recorder: Optional[_Recorder] = None
+_player: Optional[_Player] = None
+
+
+def mode() -> str:
+    return settings.http_cassette_mode if settings.http_cassette_path else OFF
+
+
+def open_cassette() -> None:
+    global _recorder, _player
+    if mode() == RECORD and _recorder is None:
+        _recorder = _Recorder(settings.http_cassette_path)
+        logger.warning("Recording upstream traffic to %s", settings.http_cassette_path)
+    elif mode() == REPLAY and _player is None:
+        _player = _Player(settings.http_cassette_path, settings.http_replay_timing == "recorded")
+
+
+def close_cassette() -> None:
+    global _recorder, _player
+    if _recorder is not None:
+        _recorder.close()
+        _recorder = None
+    _player = None
+
+
+def replaying() -> bool:
+    return _player is not None
+
+
+def recording_started_at() -> Optional[datetime]:
+    """Wall-clock start of the replayed recording, if the cassette has it.
+
+    Cassettes recorded before exchanges carried a wall-clock time return None.
+    """
+    if _player is None or _player.started_at_ms is None:
+        return None
+    return datetime.fromtimestamp(_player.started_at_ms / 1000, tz=timezone.utc)
+
+
+async def replay(upstream: str, method: str, path: str, url: str, params: Any, body: Any) -> Any:
+    if _player is None:
+        raise RuntimeError("Cassette replay is not active")
+    return await _player.play(_key(upstream, method, path, params, body), url)
+
+
+def record(
+    upstream: str, method: str, path: str, params: Any, body: Any, status: int, latency: float, response: Any
+) -> None:
+    if _recorder is not None:
+        _recorder.write(_key(upstream, method, path, params, body), status, latency, response)
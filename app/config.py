@@ -17,38 +17,200 @@ def str_to_bool(value: str | None, default: bool = False) -> bool:
 @dataclass
 class Settings:
     bot_token: str
+    bot_mode: str
+    webhook_base_url: str
+    webhook_path: str
+    webhook_secret: str
+    webhook_host: str
+    webhook_port: int
     commission_percent: float
     database_path: str
     payment_check_interval: timedelta
+    payment_poll_min_sec: float
+    payment_poll_backoff_sec: float
+    payment_idle_recheck_sec: float
+    payment_expiry_grace_sec: float
     simulate_payments: bool
     payment_receiver_address: str
+    payment_amount_step_sun: int
+    payment_amount_max_offsets: int
+    payment_amount_cooldown_minutes: int
+    deposit_address_pool_file: str
+    deposit_address_cooldown_minutes: int
     tron_api_base: str
     tron_api_key: str
+    tron_api_keys: str
+    tron_rate_per_key: float
+    tron_rate_burst: float
+    tron_ingest_page_size: int
+    tron_ingest_max_pages: int
+    balance_cache_ttl_sec: int
+    balance_cache_size: int
+    balance_batch_concurrency: int
     tronsave_api_base: str
     tronsave_api_key: str
     tronsave_duration_sec: int
     tronsave_unit_price: str
     tronsave_allow_partial_fill: bool
     tronsave_min_delegate_amount: int
+    tronsave_estimate_concurrency: int
+    tronsave_estimate_deadline_sec: float
+    quote_ttl_sec: int
+    quote_cache_size: int
+    quote_persist: bool
+    fsm_storage: str
+    usdt_payments_enabled: bool
+    trx_usdt_rate: float
+    rate_api_base: str
+    rate_refresh_sec: int
+    rate_max_age_sec: int
+    pricing_engine_enabled: bool
+    order_book_refresh_sec: int
+    order_book_max_age_sec: int
+    pricing_verify_on_invoice: bool
+    pricing_verify_tolerance_percent: float
+    delegation_workers: int
+    delegation_max_attempts: int
+    delegation_retry_base_sec: float
+    delegation_retry_max_sec: float
+    delegation_job_timeout_sec: float
+    delegation_poll_sec: float
+    order_tracker_interval_sec: float
+    order_tracker_batch_size: int
+    order_tracker_concurrency: int
+    order_fill_timeout_sec: int
+    notify_global_rate: float
+    notify_per_chat_interval_sec: float
+    notify_batch_size: int
+    notify_max_attempts: int
+    notify_idle_sec: float
+    http_pool_limit: int
+    http_pool_limit_per_host: int
+    http_keepalive_timeout_sec: float
+    http_dns_cache_ttl_sec: int
+    http_breaker_failures: int
+    http_breaker_cooldown_sec: float
+    http_hedge_after_ms: int
+    http_cassette_mode: str
+    http_cassette_path: str
+    http_replay_timing: str
+    db_synchronous: str
+    db_cache_size_kib: int
+    db_busy_timeout_ms: int
+    db_write_batch_size: int
+    db_maintenance_interval_sec: float
+    db_vacuum_pages: int
+    invoice_archive_after_days: float
+    invoice_archive_batch_size: int
+    invoice_archive_pause_sec: float
+    replica_id: str
+    metrics_host: str
+    metrics_port: int
+    leader_lease_ttl_sec: float
+    leader_lease_renew_sec: float
 
 
+_bot_mode = os.getenv("BOT_MODE", "polling").strip().lower()
+# Webhook replicas behind a load balancer must share conversation state.
+_shared_state = _bot_mode == "webhook"
+
 settings = Settings(
     bot_token=os.getenv("BOT_TOKEN", ""),
+    bot_mode=_bot_mode,
+    webhook_base_url=os.getenv("WEBHOOK_BASE_URL", "").rstrip("/"),
+    webhook_path=os.getenv("WEBHOOK_PATH", "/telegram/webhook"),
+    webhook_secret=os.getenv("WEBHOOK_SECRET", ""),
+    webhook_host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+    webhook_port=int(os.getenv("WEBHOOK_PORT", "8080")),
     commission_percent=float(os.getenv("COMMISSION_PERCENT", "10")),
     database_path=os.getenv("DATABASE_PATH", "bot_data.sqlite3"),
     payment_check_interval=timedelta(
         seconds=int(os.getenv("PAYMENT_CHECK_INTERVAL_SEC", "30"))
     ),
+    payment_poll_min_sec=float(os.getenv("PAYMENT_POLL_MIN_SEC", "3")),
+    payment_poll_backoff_sec=float(os.getenv("PAYMENT_POLL_BACKOFF_SEC", "60")),
+    payment_idle_recheck_sec=float(
+        os.getenv("PAYMENT_IDLE_RECHECK_SEC") or os.getenv("PAYMENT_CHECK_INTERVAL_SEC", "30")
+    ),
+    payment_expiry_grace_sec=float(os.getenv("PAYMENT_EXPIRY_GRACE_SEC", "60")),
     simulate_payments=str_to_bool(os.getenv("SIMULATE_PAYMENTS"), default=True),
     payment_receiver_address=os.getenv("PAYMENT_RECEIVER_ADDRESS", ""),
+    payment_amount_step_sun=int(os.getenv("PAYMENT_AMOUNT_STEP_SUN", "1000")),
+    payment_amount_max_offsets=int(os.getenv("PAYMENT_AMOUNT_MAX_OFFSETS", "1000")),
+    payment_amount_cooldown_minutes=int(os.getenv("PAYMENT_AMOUNT_COOLDOWN_MINUTES", "60")),
+    deposit_address_pool_file=os.getenv("DEPOSIT_ADDRESS_POOL_FILE", ""),
+    deposit_address_cooldown_minutes=int(os.getenv("DEPOSIT_ADDRESS_COOLDOWN_MINUTES", "60")),
     tron_api_base=os.getenv("TRON_API_BASE", "https://api.trongrid.io"),
     tron_api_key=os.getenv("TRON_API_KEY", ""),
+    tron_api_keys=os.getenv("TRON_API_KEYS", ""),
+    tron_rate_per_key=float(os.getenv("TRON_RATE_PER_KEY", "10")),
+    tron_rate_burst=float(os.getenv("TRON_RATE_BURST", "5")),
+    tron_ingest_page_size=int(os.getenv("TRON_INGEST_PAGE_SIZE", "200")),
+    tron_ingest_max_pages=int(os.getenv("TRON_INGEST_MAX_PAGES", "20")),
+    balance_cache_ttl_sec=int(os.getenv("BALANCE_CACHE_TTL_SEC", "15")),
+    balance_cache_size=int(os.getenv("BALANCE_CACHE_SIZE", "5000")),
+    balance_batch_concurrency=int(os.getenv("BALANCE_BATCH_CONCURRENCY", "10")),
     tronsave_api_base=os.getenv("TRONSAVE_API_BASE", "https://api.tronsave.io"),
     tronsave_api_key=os.getenv("TRONSAVE_API_KEY", ""),
     tronsave_duration_sec=int(os.getenv("TRONSAVE_DURATION_SEC", "259200")),
     tronsave_unit_price=os.getenv("TRONSAVE_UNIT_PRICE", "MEDIUM"),
     tronsave_allow_partial_fill=str_to_bool(os.getenv("TRONSAVE_ALLOW_PARTIAL_FILL"), True),
     tronsave_min_delegate_amount=int(os.getenv("TRONSAVE_MIN_DELEGATE_AMOUNT", "32000")),
+    tronsave_estimate_concurrency=int(os.getenv("TRONSAVE_ESTIMATE_CONCURRENCY", "6")),
+    tronsave_estimate_deadline_sec=float(os.getenv("TRONSAVE_ESTIMATE_DEADLINE_SEC", "8")),
+    quote_ttl_sec=int(os.getenv("QUOTE_TTL_SEC", "300")),
+    quote_cache_size=int(os.getenv("QUOTE_CACHE_SIZE", "10000")),
+    quote_persist=str_to_bool(os.getenv("QUOTE_PERSIST") or None, _shared_state),
+    fsm_storage=(os.getenv("FSM_STORAGE") or ("sqlite" if _shared_state else "memory")).strip().lower(),
+    usdt_payments_enabled=str_to_bool(os.getenv("USDT_PAYMENTS_ENABLED"), False),
+    trx_usdt_rate=float(os.getenv("TRX_USDT_RATE", "0")),
+    rate_api_base=os.getenv("RATE_API_BASE", "https://api.binance.com"),
+    rate_refresh_sec=int(os.getenv("RATE_REFRESH_SEC", "60")),
+    rate_max_age_sec=int(os.getenv("RATE_MAX_AGE_SEC", "600")),
+    pricing_engine_enabled=str_to_bool(os.getenv("PRICING_ENGINE_ENABLED"), True),
+    order_book_refresh_sec=int(os.getenv("ORDER_BOOK_REFRESH_SEC", "30")),
+    order_book_max_age_sec=int(os.getenv("ORDER_BOOK_MAX_AGE_SEC", "120")),
+    pricing_verify_on_invoice=str_to_bool(os.getenv("PRICING_VERIFY_ON_INVOICE"), False),
+    pricing_verify_tolerance_percent=float(os.getenv("PRICING_VERIFY_TOLERANCE_PERCENT", "5")),
+    delegation_workers=int(os.getenv("DELEGATION_WORKERS", "4")),
+    delegation_max_attempts=int(os.getenv("DELEGATION_MAX_ATTEMPTS", "6")),
+    delegation_retry_base_sec=float(os.getenv("DELEGATION_RETRY_BASE_SEC", "10")),
+    delegation_retry_max_sec=float(os.getenv("DELEGATION_RETRY_MAX_SEC", "600")),
+    delegation_job_timeout_sec=float(os.getenv("DELEGATION_JOB_TIMEOUT_SEC", "120")),
+    delegation_poll_sec=float(os.getenv("DELEGATION_POLL_SEC", "30")),
+    order_tracker_interval_sec=float(os.getenv("ORDER_TRACKER_INTERVAL_SEC", "60")),
+    order_tracker_batch_size=int(os.getenv("ORDER_TRACKER_BATCH_SIZE", "50")),
+    order_tracker_concurrency=int(os.getenv("ORDER_TRACKER_CONCURRENCY", "5")),
+    order_fill_timeout_sec=int(os.getenv("ORDER_FILL_TIMEOUT_SEC", "3600")),
+    notify_global_rate=float(os.getenv("NOTIFY_GLOBAL_RATE", "30")),
+    notify_per_chat_interval_sec=float(os.getenv("NOTIFY_PER_CHAT_INTERVAL_SEC", "1")),
+    notify_batch_size=int(os.getenv("NOTIFY_BATCH_SIZE", "100")),
+    notify_max_attempts=int(os.getenv("NOTIFY_MAX_ATTEMPTS", "5")),
+    notify_idle_sec=float(os.getenv("NOTIFY_IDLE_SEC", "30")),
+    http_pool_limit=int(os.getenv("HTTP_POOL_LIMIT", "100")),
+    http_pool_limit_per_host=int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20")),
+    http_keepalive_timeout_sec=float(os.getenv("HTTP_KEEPALIVE_TIMEOUT_SEC", "30")),
+    http_dns_cache_ttl_sec=int(os.getenv("HTTP_DNS_CACHE_TTL_SEC", "300")),
+    http_breaker_failures=int(os.getenv("HTTP_BREAKER_FAILURES", "5")),
+    http_breaker_cooldown_sec=float(os.getenv("HTTP_BREAKER_COOLDOWN_SEC", "30")),
+    http_hedge_after_ms=int(os.getenv("HTTP_HEDGE_AFTER_MS", "1000")),
+    http_cassette_mode=os.getenv("HTTP_CASSETTE_MODE", "off").strip().lower(),
+    http_cassette_path=os.getenv("HTTP_CASSETTE_PATH", ""),
+    http_replay_timing=os.getenv("HTTP_REPLAY_TIMING", "fast").strip().lower(),
+    db_synchronous=os.getenv("DB_SYNCHRONOUS", "NORMAL").upper(),
+    db_cache_size_kib=int(os.getenv("DB_CACHE_SIZE_KIB", "16384")),
+    db_busy_timeout_ms=int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000")),
+    db_write_batch_size=int(os.getenv("DB_WRITE_BATCH_SIZE", "100")),
+    db_maintenance_interval_sec=float(os.getenv("DB_MAINTENANCE_INTERVAL_SEC", "3600")),
+    db_vacuum_pages=int(os.getenv("DB_VACUUM_PAGES", "500")),
+    invoice_archive_after_days=float(os.getenv("INVOICE_ARCHIVE_AFTER_DAYS", "30")),
+    invoice_archive_batch_size=int(os.getenv("INVOICE_ARCHIVE_BATCH_SIZE", "500")),
+    invoice_archive_pause_sec=float(os.getenv("INVOICE_ARCHIVE_PAUSE_SEC", "0.05")),
+    replica_id=os.getenv("REPLICA_ID", ""),
+    metrics_host=os.getenv("METRICS_HOST", "127.0.0.1"),
+    metrics_port=int(os.getenv("METRICS_PORT", "0")),
+    leader_lease_ttl_sec=float(os.getenv("LEADER_LEASE_TTL_SEC", "15")),
+    leader_lease_renew_sec=float(os.getenv("LEADER_LEASE_RENEW_SEC", "5")),
 )
 
 logging.basicConfig(
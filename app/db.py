@@ -1,65 +1,653 @@
+import asyncio
 import logging
+import math
+import time
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from typing import List, Optional
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, TypeVar
 
 import aiosqlite
 
+from . import metrics
 from .config import settings
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+WriteOp = Callable[[aiosqlite.Connection], Awaitable[Any]]
 
-@dataclass
+
+def _from_ms(value: int) -> datetime:
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+TRX = "TRX"
+USDT = "USDT"
+
+
+@dataclass(slots=True)
 class Invoice:
+    """One invoice row; fields are in ``_INVOICE_SELECT`` order so rows unpack directly.
+
+    Money is in the smallest unit of ``currency`` (SUN for TRX, 10^-6 USDT for
+    USDT; both have six decimals) and timestamps in epoch milliseconds; the
+    ``datetime`` and TRX properties are for display.
+    """
+
     id: int
     user_id: int
     wallet_address: str
     energy_amount: int
-    base_price_trx: float
-    final_price_trx: float
+    base_price_sun: int
+    final_price_sun: int
+    payable_amount_sun: int
     unique_payment_address: str
-    created_at: datetime
-    expires_at: datetime
+    created_at_ms: int
+    expires_at_ms: int
     status: str
+    currency: str = TRX
 
+    @property
+    def created_at(self) -> datetime:
+        return _from_ms(self.created_at_ms)
 
-async def init_db() -> None:
-    async with aiosqlite.connect(settings.database_path) as db:
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                first_name TEXT,
-                username TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """
+    @property
+    def expires_at(self) -> datetime:
+        return _from_ms(self.expires_at_ms)
+
+    @property
+    def base_price_trx(self) -> float:
+        return self.base_price_sun / 1_000_000
+
+    @property
+    def final_price_trx(self) -> float:
+        return self.final_price_sun / 1_000_000
+
+
+_INVOICE_SELECT = """
+    SELECT id, user_id, wallet_address, energy_amount, base_price_sun, final_price_sun,
+           payable_amount_sun, unique_payment_address, created_at, expires_at, status, currency
+    FROM invoices
+"""
+
+
+@dataclass(frozen=True)
+class Transfer:
+    """An incoming transfer; ``amount_sun`` is in the smallest unit of ``asset``."""
+
+    tx_id: str
+    to_hex: str
+    amount_sun: int
+    timestamp_ms: int
+    asset: str = TRX
+
+
+@dataclass
+class DelegationJob:
+    id: int
+    invoice_id: int
+    idempotency_key: str
+    user_id: int
+    wallet_address: str
+    energy_amount: int
+    attempts: int
+    order_id: Optional[str]
+
+
+@dataclass
+class TrackedOrder:
+    job_id: int
+    invoice_id: int
+    user_id: int
+    wallet_address: str
+    energy_amount: int
+    order_id: str
+    ordered_at: datetime
+
+
+@dataclass
+class Notification:
+    id: int
+    chat_id: int
+    text: str
+    attempts: int
+
+
+@dataclass
+class IngestCursor:
+    stream: str
+    last_timestamp: int
+    fingerprint: Optional[str]
+
+
+class _WriteCoalescer:
+    """Serialize writes and commit whatever queued up together in one transaction.
+
+    Each write runs inside its own savepoint so a failing statement only rolls
+    back its own changes, not the rest of the batch. ``run_alone`` runs a
+    statement that cannot be part of a transaction, such as VACUUM, between
+    batches.
+    """
+
+    def __init__(self, conn: aiosqlite.Connection, max_batch: int) -> None:
+        self._conn = conn
+        self._max_batch = max(1, max_batch)
+        self._queue: asyncio.Queue[tuple[WriteOp, asyncio.Future] | None] = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._batch_lock = asyncio.Lock()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, op: Callable[[aiosqlite.Connection], Awaitable[T]]) -> T:
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        await self._queue.put((op, future))
+        return await future
+
+    async def run_alone(self, op: Callable[[aiosqlite.Connection], Awaitable[T]]) -> T:
+        async with self._batch_lock:
+            return await op(self._conn)
+
+    async def _run(self) -> None:
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            while len(batch) < self._max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            async with self._batch_lock:
+                await self._commit(batch)
+            if stopping:
+                return
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    async def _commit(self, batch: list[tuple[WriteOp, asyncio.Future]]) -> None:
+        metrics.DB_WRITE_BATCH.observe(len(batch))
+        outcomes: list[tuple[asyncio.Future, Any, BaseException | None]] = []
+        try:
+            await self._conn.execute("BEGIN IMMEDIATE")
+            for op, future in batch:
+                await self._conn.execute("SAVEPOINT write_op")
+                try:
+                    result = await op(self._conn)
+                except Exception as exc:  # noqa: BLE001
+                    await self._conn.execute("ROLLBACK TO write_op")
+                    await self._conn.execute("RELEASE write_op")
+                    outcomes.append((future, None, exc))
+                else:
+                    await self._conn.execute("RELEASE write_op")
+                    outcomes.append((future, result, None))
+            await self._conn.execute("COMMIT")
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("Failed to commit batch of %s writes", len(batch))
+            if self._conn.in_transaction:
+                await self._conn.execute("ROLLBACK")
+            outcomes = [(future, None, exc) for _, future in batch]
+
+        for future, result, error in outcomes:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+_conn: Optional[aiosqlite.Connection] = None
+_writer: Optional[_WriteCoalescer] = None
+
+
+def _db() -> aiosqlite.Connection:
+    if _conn is None:
+        raise RuntimeError("Database is not initialized; call init_db() first")
+    return _conn
+
+
+def _timed(fn: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    return metrics.timed(metrics.DB_SECONDS, operation=fn.__name__)(fn)
+
+
+async def _write(op: Callable[[aiosqlite.Connection], Awaitable[T]]) -> T:
+    if _writer is None:
+        raise RuntimeError("Database is not initialized; call init_db() first")
+    return await _writer.submit(op)
+
+
+async def _apply_pragmas(conn: aiosqlite.Connection) -> None:
+    # Wait for other replicas' locks from the very first statement on.
+    await conn.execute(f"PRAGMA busy_timeout={settings.db_busy_timeout_ms}")
+    # Must precede WAL, which writes the header of a new file.
+    await _enable_incremental_vacuum(conn)
+    await conn.execute("PRAGMA journal_mode=WAL")
+    await conn.execute(f"PRAGMA synchronous={settings.db_synchronous}")
+    await conn.execute(f"PRAGMA cache_size=-{settings.db_cache_size_kib}")
+    await conn.execute("PRAGMA temp_store=MEMORY")
+
+
+async def _enable_incremental_vacuum(conn: aiosqlite.Connection) -> None:
+    """Use incremental auto-vacuum for a new file so archived space can be reclaimed.
+
+    Existing files need a VACUUM for the mode to take effect; that is left to
+    ``enable_incremental_vacuum`` in the leader's maintenance pass, so replicas
+    starting together never race for it.
+    """
+    async with conn.execute("PRAGMA auto_vacuum") as cursor:
+        row = await cursor.fetchone()
+    if row and row[0] == 2:
+        return
+    async with conn.execute("SELECT COUNT(*) FROM sqlite_master") as cursor:
+        row = await cursor.fetchone()
+    if row and row[0] == 0:
+        await conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+
+
+async def _ensure_column(conn: aiosqlite.Connection, table: str, column: str, decl: str) -> None:
+    async with conn.execute(f"PRAGMA table_info({table})") as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    if column not in columns:
+        await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+async def _migrate_v1(conn: aiosqlite.Connection) -> None:
+    """Baseline schema; also brings databases created before versioning up to date."""
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            first_name TEXT,
+            username TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS invoices (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                wallet_address TEXT NOT NULL,
-                energy_amount INTEGER NOT NULL,
-                base_price_trx REAL NOT NULL,
-                final_price_trx REAL NOT NULL,
-                unique_payment_address TEXT NOT NULL,
-                created_at TIMESTAMP NOT NULL,
-                expires_at TIMESTAMP NOT NULL,
-                status TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-            """
+        """
+    )
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS invoices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            wallet_address TEXT NOT NULL,
+            energy_amount INTEGER NOT NULL,
+            base_price_trx REAL NOT NULL,
+            final_price_trx REAL NOT NULL,
+            payable_amount_sun INTEGER,
+            unique_payment_address TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            expires_at TIMESTAMP NOT NULL,
+            status TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+        """
+    )
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS invoices_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            wallet_address TEXT NOT NULL,
+            energy_amount INTEGER NOT NULL,
+            base_price_trx REAL NOT NULL,
+            final_price_trx REAL NOT NULL,
+            payable_amount_sun INTEGER,
+            unique_payment_address TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            expires_at TIMESTAMP NOT NULL,
+            status TEXT NOT NULL,
+            archived_at TIMESTAMP NOT NULL
+        )
+        """
+    )
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ingest_cursors (
+            stream TEXT PRIMARY KEY,
+            last_timestamp INTEGER NOT NULL,
+            fingerprint TEXT
+        )
+        """
+    )
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS incoming_transfers (
+            tx_id TEXT PRIMARY KEY,
+            to_hex TEXT NOT NULL,
+            amount_sun INTEGER NOT NULL,
+            block_timestamp INTEGER NOT NULL,
+            invoice_id INTEGER
+        )
+        """
+    )
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS deposit_addresses (
+            address TEXT PRIMARY KEY,
+            invoice_id INTEGER,
+            released_at TIMESTAMP
+        )
+        """
+    )
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS quotes (
+            id TEXT PRIMARY KEY,
+            wallet_address TEXT NOT NULL,
+            packages TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        """
+    )
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS delegation_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            invoice_id INTEGER NOT NULL UNIQUE,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            user_id INTEGER NOT NULL,
+            wallet_address TEXT NOT NULL,
+            energy_amount INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL,
+            order_id TEXT,
+            order_status TEXT,
+            order_checked_at TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        )
+        """
+    )
+    await conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_delegation_jobs_due
+        ON delegation_jobs (status, next_attempt_at)
+        """
+    )
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL,
+            created_at TIMESTAMP NOT NULL
         )
-        await db.commit()
+        """
+    )
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (next_attempt_at)")
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at TIMESTAMP NOT NULL
+        )
+        """
+    )
+    await _ensure_column(conn, "invoices", "payable_amount_sun", "INTEGER")
+    await _ensure_column(conn, "delegation_jobs", "order_status", "TEXT")
+    await _ensure_column(conn, "delegation_jobs", "order_checked_at", "TIMESTAMP")
+    await _ensure_column(conn, "incoming_transfers", "invoice_id", "INTEGER")
+    await conn.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_invoices_pending_amount
+        ON invoices (unique_payment_address, payable_amount_sun)
+        WHERE status = 'pending'
+        """
+    )
+    await conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_invoices_status_expires
+        ON invoices (status, expires_at)
+        """
+    )
+    await conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_incoming_transfers_to_ts
+        ON incoming_transfers (to_hex, block_timestamp)
+        """
+    )
+
+
+def _iso_to_ms(value: Any) -> int:
+    if isinstance(value, (int, float)):
+        return int(value)
+    parsed = datetime.fromisoformat(str(value))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+def _trx_to_sun(value: Optional[float]) -> int:
+    return round((value or 0) * 1_000_000)
+
+
+_INVOICE_COLUMNS_V2 = """
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    wallet_address TEXT NOT NULL,
+    energy_amount INTEGER NOT NULL,
+    base_price_sun INTEGER NOT NULL,
+    final_price_sun INTEGER NOT NULL,
+    payable_amount_sun INTEGER NOT NULL,
+    unique_payment_address TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    expires_at INTEGER NOT NULL,
+    status TEXT NOT NULL
+"""
+
+
+_AMBIGUOUS_INVOICE_NOTICE = (
+    "❌ Your invoice was cancelled during an upgrade because another open invoice had the same amount.\n"
+    "If you already paid it, please contact support; otherwise create a new one."
+)
+
+
+def _ambiguous_pending(rows: List[Dict[str, Any]]) -> set[int]:
+    """Ids of pending invoices that share their address and amount with another one.
+
+    Invoices created before unique amounts were shown their price, so a
+    transfer of that price cannot tell which of them it pays. Changing the
+    amount would not help either, since the users were already told it.
+    """
+    groups: Dict[tuple[str, int], List[int]] = {}
+    for row in rows:
+        if row["status"] == "pending":
+            amount = row["payable_amount_sun"] or _trx_to_sun(row["final_price_trx"])
+            groups.setdefault((row["unique_payment_address"], amount), []).append(row["id"])
+    return {invoice_id for ids in groups.values() if len(ids) > 1 for invoice_id in ids}
+
+
+async def _migrate_v2(conn: aiosqlite.Connection) -> None:
+    """Store invoice timestamps as epoch milliseconds and prices as integer SUN.
+
+    Pending invoices that cannot be told apart by amount are expired and their
+    users notified through the outbox.
+    """
+    ambiguous: List[tuple[int, int]] = []
+    for table, extra in (("invoices", ""), ("invoices_archive", ",\n    archived_at INTEGER NOT NULL")):
+        columns = _INVOICE_COLUMNS_V2 + extra
+        if table == "invoices_archive":
+            columns = columns.replace("INTEGER PRIMARY KEY AUTOINCREMENT", "INTEGER PRIMARY KEY")
+        await conn.execute(f"CREATE TABLE {table}_v2 ({columns})")
+        async with conn.execute(f"SELECT * FROM {table}") as cursor:
+            names = [col[0] for col in cursor.description]
+            rows = [dict(zip(names, row)) for row in await cursor.fetchall()]
+        expire_ids = _ambiguous_pending(rows) if table == "invoices" else set()
+        converted = []
+        for row in rows:
+            status = row["status"]
+            if row["id"] in expire_ids:
+                status = "expired"
+                ambiguous.append((row["id"], row["user_id"]))
+            values = [
+                row["id"],
+                row["user_id"],
+                row["wallet_address"],
+                row["energy_amount"],
+                _trx_to_sun(row["base_price_trx"]),
+                _trx_to_sun(row["final_price_trx"]),
+                row["payable_amount_sun"] or _trx_to_sun(row["final_price_trx"]),
+                row["unique_payment_address"],
+                _iso_to_ms(row["created_at"]),
+                _iso_to_ms(row["expires_at"]),
+                status,
+            ]
+            if extra:
+                values.append(_iso_to_ms(row["archived_at"]))
+            converted.append(values)
+        if converted:
+            placeholders = ",".join("?" * len(converted[0]))
+            await conn.executemany(f"INSERT INTO {table}_v2 VALUES ({placeholders})", converted)
+        await conn.execute(f"DROP TABLE {table}")
+        await conn.execute(f"ALTER TABLE {table}_v2 RENAME TO {table}")
+
+    await conn.execute(
+        """
+        CREATE UNIQUE INDEX idx_invoices_pending_amount
+        ON invoices (unique_payment_address, payable_amount_sun)
+        WHERE status = 'pending'
+        """
+    )
+    await conn.execute("CREATE INDEX idx_invoices_status_expires ON invoices (status, expires_at)")
+
+    if ambiguous:
+        logger.warning("Expired %s pending invoices that shared an amount", len(ambiguous))
+        now = datetime.now(timezone.utc).isoformat()
+        await conn.executemany(
+            "UPDATE deposit_addresses SET invoice_id=NULL, released_at=? WHERE invoice_id=?",
+            [(now, invoice_id) for invoice_id, _ in ambiguous],
+        )
+        await conn.executemany(
+            "INSERT INTO outbox (chat_id, text, next_attempt_at, created_at) VALUES (?, ?, ?, ?)",
+            [(user_id, _AMBIGUOUS_INVOICE_NOTICE, now, now) for _, user_id in ambiguous],
+        )
+
+
+async def _migrate_v3(conn: aiosqlite.Connection) -> None:
+    """Add the invoice currency and transfer asset so USDT payments sit next to TRX ones."""
+    await conn.execute("ALTER TABLE invoices ADD COLUMN currency TEXT NOT NULL DEFAULT 'TRX'")
+    await conn.execute("ALTER TABLE invoices_archive ADD COLUMN currency TEXT NOT NULL DEFAULT 'TRX'")
+    await conn.execute("ALTER TABLE incoming_transfers ADD COLUMN asset TEXT NOT NULL DEFAULT 'TRX'")
+    await conn.execute("DROP INDEX idx_invoices_pending_amount")
+    await conn.execute(
+        """
+        CREATE UNIQUE INDEX idx_invoices_pending_amount
+        ON invoices (unique_payment_address, currency, payable_amount_sun)
+        WHERE status = 'pending'
+        """
+    )
+
+
+async def _migrate_v4(conn: aiosqlite.Connection) -> None:
+    """Keep bot conversation state in the database so webhook replicas share it."""
+    await conn.execute(
+        """
+        CREATE TABLE fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}'
+        )
+        """
+    )
+
+
+async def _migrate_v5(conn: aiosqlite.Connection) -> None:
+    """Index recently used amounts per address, which new invoices must avoid."""
+    await conn.execute(
+        """
+        CREATE INDEX idx_invoices_address_amount
+        ON invoices (unique_payment_address, currency, payable_amount_sun, expires_at)
+        """
+    )
+
+
+# Applied in order; a database at ``PRAGMA user_version`` N has run the first N.
+_MIGRATIONS: List[Callable[[aiosqlite.Connection], Awaitable[None]]] = [
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+    _migrate_v5,
+]
+
+
+async def _migrate(conn: aiosqlite.Connection) -> None:
+    """Apply pending migrations, one write transaction each.
+
+    The version is read again under the write lock, so a replica that waited
+    for another one's migration does not apply it a second time.
+    """
+    while True:
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            async with conn.execute("PRAGMA user_version") as cursor:
+                row = await cursor.fetchone()
+            version = row[0] if row else 0
+            if version >= len(_MIGRATIONS):
+                await conn.execute("COMMIT")
+                return
+            await _MIGRATIONS[version](conn)
+            await conn.execute(f"PRAGMA user_version={version + 1}")
+        except Exception:  # noqa: BLE001
+            await conn.execute("ROLLBACK")
+            raise
+        await conn.execute("COMMIT")
+        logger.info("Database schema migrated to version %s", version + 1)
+
+
+async def init_db() -> None:
+    global _conn, _writer
+    if _conn is not None:
+        return
+    conn = await aiosqlite.connect(settings.database_path, isolation_level=None)
+    try:
+        await _apply_pragmas(conn)
+        await _migrate(conn)
+    except BaseException:
+        # Close so the connection thread does not keep the process alive.
+        await conn.close()
+        raise
+
+    _conn = conn
+    _writer = _WriteCoalescer(conn, settings.db_write_batch_size)
+    _writer.start()
     logger.info("Database initialized at %s", settings.database_path)
 
 
+async def close_db() -> None:
+    global _conn, _writer
+    if _writer is not None:
+        await _writer.stop()
+        _writer = None
+    if _conn is not None:
+        await _conn.close()
+        _conn = None
+
+
+@_timed
 async def upsert_user(user_id: int, first_name: str, username: Optional[str]) -> None:
-    async with aiosqlite.connect(settings.database_path) as db:
-        await db.execute(
+    async def op(conn: aiosqlite.Connection) -> None:
+        await conn.execute(
             """
             INSERT INTO users (user_id, first_name, username)
             VALUES (?, ?, ?)
@@ -69,98 +657,705 @@ async def upsert_user(user_id: int, first_name: str, username: Optional[str]) ->
             """,
             (user_id, first_name, username),
         )
-        await db.commit()
+
+    await _write(op)
+
+
+async def _allocate_payable_amount(
+    conn: aiosqlite.Connection, unique_payment_address: str, final_price_sun: int, currency: str
+) -> int:
+    """Pick the smallest free amount at or above the price for this address and currency.
+
+    Amounts are rounded up to ``PAYMENT_AMOUNT_STEP_SUN`` and then bumped one
+    step at a time until no other invoice to the same address in the same
+    currency uses it, so a transfer maps back to exactly one invoice. Amounts
+    of invoices whose deadline passed less than PAYMENT_AMOUNT_COOLDOWN_MINUTES
+    ago stay taken, so a late payment is not credited to a newer invoice.
+    """
+    step = max(1, settings.payment_amount_step_sun)
+    base = math.ceil(final_price_sun / step) * step
+    top = base + step * (settings.payment_amount_max_offsets - 1)
+    cooled_down_ms = _now_ms() - settings.payment_amount_cooldown_minutes * 60_000
+    async with conn.execute(
+        """
+        SELECT payable_amount_sun FROM invoices
+        WHERE unique_payment_address = ? AND currency = ?
+          AND payable_amount_sun BETWEEN ? AND ?
+          AND (status = 'pending' OR expires_at > ?)
+        """,
+        (unique_payment_address, currency, base, top, cooled_down_ms),
+    ) as cursor:
+        taken = {row[0] for row in await cursor.fetchall()}
+    for amount in range(base, top + 1, step):
+        if amount not in taken:
+            return amount
+    raise RuntimeError(f"No free payable amount near {final_price_sun} SUN")
+
+
+async def _allocate_deposit_address(conn: aiosqlite.Connection, now: datetime) -> str:
+    """Take a free pool address whose cooldown since its last invoice has passed."""
+    cooled_down = now - timedelta(minutes=settings.deposit_address_cooldown_minutes)
+    async with conn.execute(
+        """
+        SELECT address FROM deposit_addresses
+        WHERE invoice_id IS NULL AND (released_at IS NULL OR released_at <= ?)
+        ORDER BY released_at IS NOT NULL, released_at
+        LIMIT 1
+        """,
+        (cooled_down.isoformat(),),
+    ) as cursor:
+        row = await cursor.fetchone()
+    if row is None:
+        raise RuntimeError("Deposit address pool is exhausted")
+    return row[0]
 
 
+@_timed
 async def create_invoice(
     user_id: int,
     wallet_address: str,
     energy_amount: int,
-    base_price_trx: float,
-    final_price_trx: float,
-    unique_payment_address: str,
-    validity_minutes: int = 20,
+    base_price_sun: int,
+    final_price_sun: int,
+    unique_payment_address: Optional[str],
+    validity_minutes: float = 20,
+    currency: str = TRX,
 ) -> Invoice:
-    created_at = datetime.now(timezone.utc)
-    expires_at = created_at + timedelta(minutes=validity_minutes)
-    async with aiosqlite.connect(settings.database_path) as db:
-        cursor = await db.execute(
+    """Create a pending invoice.
+
+    Pass ``unique_payment_address=None`` to take a dedicated address from the
+    deposit address pool instead of a shared receiver. Prices are in the
+    smallest unit of ``currency``.
+    """
+    created_at_ms = _now_ms()
+    expires_at_ms = created_at_ms + int(validity_minutes * 60_000)
+
+    async def op(conn: aiosqlite.Connection) -> tuple[int, int, str]:
+        address = unique_payment_address
+        if address is None:
+            address = await _allocate_deposit_address(conn, _from_ms(created_at_ms))
+        payable_amount_sun = await _allocate_payable_amount(conn, address, final_price_sun, currency)
+        cursor = await conn.execute(
             """
             INSERT INTO invoices (
-                user_id, wallet_address, energy_amount, base_price_trx,
-                final_price_trx, unique_payment_address, created_at, expires_at, status
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending')
+                user_id, wallet_address, energy_amount, base_price_sun, final_price_sun,
+                payable_amount_sun, unique_payment_address, created_at, expires_at, status, currency
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending', ?)
             """,
             (
                 user_id,
                 wallet_address,
                 energy_amount,
-                base_price_trx,
-                final_price_trx,
-                unique_payment_address,
-                created_at.isoformat(),
-                expires_at.isoformat(),
+                base_price_sun,
+                final_price_sun,
+                payable_amount_sun,
+                address,
+                created_at_ms,
+                expires_at_ms,
+                currency,
             ),
         )
-        await db.commit()
-        invoice_id = cursor.lastrowid
+        if unique_payment_address is None:
+            await conn.execute(
+                "UPDATE deposit_addresses SET invoice_id=? WHERE address=?",
+                (cursor.lastrowid, address),
+            )
+        return cursor.lastrowid, payable_amount_sun, address
+
+    invoice_id, payable_amount_sun, address = await _write(op)
     return Invoice(
-        id=invoice_id,
-        user_id=user_id,
-        wallet_address=wallet_address,
-        energy_amount=energy_amount,
-        base_price_trx=base_price_trx,
-        final_price_trx=final_price_trx,
-        unique_payment_address=unique_payment_address,
-        created_at=created_at,
-        expires_at=expires_at,
-        status="pending",
+        invoice_id,
+        user_id,
+        wallet_address,
+        energy_amount,
+        base_price_sun,
+        final_price_sun,
+        payable_amount_sun,
+        address,
+        created_at_ms,
+        expires_at_ms,
+        "pending",
+        currency,
     )
 
 
+@_timed
 async def get_pending_invoices() -> List[Invoice]:
-    async with aiosqlite.connect(settings.database_path) as db:
-        cursor = await db.execute(
+    async with _db().execute(_INVOICE_SELECT + " WHERE status = 'pending'") as cursor:
+        rows = await cursor.fetchall()
+    return [Invoice(*row) for row in rows]
+
+
+async def _release_deposit_addresses(conn: aiosqlite.Connection, invoice_ids: List[int]) -> None:
+    released_at = datetime.now(timezone.utc).isoformat()
+    await conn.executemany(
+        "UPDATE deposit_addresses SET invoice_id=NULL, released_at=? WHERE invoice_id=?",
+        [(released_at, invoice_id) for invoice_id in invoice_ids],
+    )
+
+
+async def _enqueue_delegation(conn: aiosqlite.Connection, invoice_id: int) -> None:
+    now = datetime.now(timezone.utc).isoformat()
+    await conn.execute(
+        """
+        INSERT OR IGNORE INTO delegation_jobs (
+            invoice_id, idempotency_key, user_id, wallet_address, energy_amount,
+            status, next_attempt_at, created_at, updated_at
+        )
+        SELECT id, 'invoice-' || id, user_id, wallet_address, energy_amount, 'queued', ?, ?, ?
+        FROM invoices WHERE id = ?
+        """,
+        (now, now, now, invoice_id),
+    )
+
+
+@_timed
+async def mark_invoices_paid(payments: List[tuple[int, Optional[str]]]) -> List[int]:
+    """Mark invoices paid and queue their delegation jobs in one transaction.
+
+    Each ``(invoice_id, tx_id)`` claims its transfer so it cannot pay another
+    invoice. Pairs whose transfer was already claimed or whose invoice is no
+    longer pending are skipped. Returns the ids of invoices marked paid.
+    """
+    if not payments:
+        return []
+
+    async def op(conn: aiosqlite.Connection) -> List[int]:
+        paid: List[int] = []
+        for invoice_id, tx_id in payments:
+            if tx_id is not None:
+                cursor = await conn.execute(
+                    """
+                    UPDATE incoming_transfers SET invoice_id=?
+                    WHERE tx_id=? AND invoice_id IS NULL
+                      AND EXISTS (
+                          SELECT 1 FROM invoices
+                          WHERE id=? AND status='pending' AND currency=incoming_transfers.asset
+                      )
+                    """,
+                    (invoice_id, tx_id, invoice_id),
+                )
+                if cursor.rowcount != 1:
+                    continue
+            cursor = await conn.execute(
+                "UPDATE invoices SET status='paid' WHERE id=? AND status='pending'",
+                (invoice_id,),
+            )
+            if cursor.rowcount == 1:
+                paid.append(invoice_id)
+        await _release_deposit_addresses(conn, paid)
+        for invoice_id in paid:
+            await _enqueue_delegation(conn, invoice_id)
+        return paid
+
+    return await _write(op)
+
+
+@_timed
+async def mark_invoice_paid(invoice_id: int, tx_id: Optional[str] = None) -> bool:
+    return bool(await mark_invoices_paid([(invoice_id, tx_id)]))
+
+
+@_timed
+async def expire_invoices(invoice_ids: List[int]) -> List[tuple[int, int]]:
+    """Expire the given invoices that are still pending in one statement.
+
+    Returns ``(invoice_id, user_id)`` for each invoice expired by this call.
+    """
+    if not invoice_ids:
+        return []
+
+    async def op(conn: aiosqlite.Connection) -> List[tuple[int, int]]:
+        placeholders = ",".join("?" * len(invoice_ids))
+        async with conn.execute(
+            f"""
+            UPDATE invoices SET status='expired'
+            WHERE status='pending' AND id IN ({placeholders})
+            RETURNING id, user_id
+            """,
+            invoice_ids,
+        ) as cursor:
+            rows = [(row[0], row[1]) for row in await cursor.fetchall()]
+        await _release_deposit_addresses(conn, [invoice_id for invoice_id, _ in rows])
+        return rows
+
+    return await _write(op)
+
+
+FINAL_INVOICE_STATUSES = ("expired", "delegated", "partially_filled", "failed")
+
+
+@_timed
+async def archive_finished_invoices(expired_before: datetime, limit: int) -> int:
+    """Move a batch of finished invoices into ``invoices_archive``.
+
+    At most ``limit`` invoices in a final status that expired before
+    ``expired_before`` are moved. Returns the number of rows moved.
+    """
+    placeholders = ",".join("?" * len(FINAL_INVOICE_STATUSES))
+
+    async def op(conn: aiosqlite.Connection) -> int:
+        async with conn.execute(
+            f"""
+            SELECT id FROM invoices
+            WHERE status IN ({placeholders}) AND expires_at < ?
+            LIMIT ?
+            """,
+            (*FINAL_INVOICE_STATUSES, int(expired_before.timestamp() * 1000), limit),
+        ) as cursor:
+            ids = [(row[0],) for row in await cursor.fetchall()]
+        if not ids:
+            return 0
+        archived_at = _now_ms()
+        await conn.executemany(
             """
-            SELECT id, user_id, wallet_address, energy_amount, base_price_trx,
-                   final_price_trx, unique_payment_address, created_at, expires_at, status
-            FROM invoices
-            WHERE status = 'pending'
+            INSERT OR REPLACE INTO invoices_archive (
+                id, user_id, wallet_address, energy_amount, base_price_sun, final_price_sun,
+                payable_amount_sun, unique_payment_address, created_at, expires_at, status,
+                archived_at, currency
+            )
+            SELECT id, user_id, wallet_address, energy_amount, base_price_sun, final_price_sun,
+                   payable_amount_sun, unique_payment_address, created_at, expires_at, status, ?, currency
+            FROM invoices WHERE id=?
+            """,
+            [(archived_at, invoice_id) for (invoice_id,) in ids],
+        )
+        await conn.executemany("DELETE FROM invoices WHERE id=?", ids)
+        return len(ids)
+
+    return await _write(op)
+
+
+@_timed
+async def enable_incremental_vacuum() -> bool:
+    """Rebuild an older file with incremental auto-vacuum; returns whether it ran.
+
+    VACUUM rewrites the whole file and blocks every writer, including other
+    replicas, until it finishes.
+    """
+    if _writer is None:
+        raise RuntimeError("Database is not initialized; call init_db() first")
+
+    async def op(conn: aiosqlite.Connection) -> bool:
+        async with conn.execute("PRAGMA auto_vacuum") as cursor:
+            row = await cursor.fetchone()
+        if row and row[0] == 2:
+            return False
+        logger.info("Rebuilding %s to enable incremental vacuum", settings.database_path)
+        await conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        await conn.execute("VACUUM")
+        return True
+
+    return await _writer.run_alone(op)
+
+
+@_timed
+async def incremental_vacuum(pages: int) -> int:
+    """Return up to ``pages`` free pages to the filesystem; returns the pages still free."""
+
+    async def op(conn: aiosqlite.Connection) -> int:
+        async with conn.execute(f"PRAGMA incremental_vacuum({max(1, int(pages))})") as cursor:
+            await cursor.fetchall()
+        async with conn.execute("PRAGMA freelist_count") as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else 0
+
+    return await _write(op)
+
+
+@_timed
+async def get_ingest_cursor(stream: str) -> Optional[IngestCursor]:
+    async with _db().execute(
+        "SELECT stream, last_timestamp, fingerprint FROM ingest_cursors WHERE stream=?",
+        (stream,),
+    ) as cursor:
+        row = await cursor.fetchone()
+    if row is None:
+        return None
+    return IngestCursor(stream=row[0], last_timestamp=row[1], fingerprint=row[2])
+
+
+@_timed
+async def save_ingested_page(
+    stream: str,
+    transfers: List[Transfer],
+    last_timestamp: int,
+    fingerprint: Optional[str],
+) -> None:
+    """Store a page of transfers and advance the stream cursor atomically."""
+
+    async def op(conn: aiosqlite.Connection) -> None:
+        if transfers:
+            await conn.executemany(
+                """
+                INSERT OR IGNORE INTO incoming_transfers (tx_id, to_hex, amount_sun, block_timestamp, asset)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                [(t.tx_id, t.to_hex, t.amount_sun, t.timestamp_ms, t.asset) for t in transfers],
+            )
+        await conn.execute(
             """
+            INSERT INTO ingest_cursors (stream, last_timestamp, fingerprint)
+            VALUES (?, ?, ?)
+            ON CONFLICT(stream) DO UPDATE SET
+                last_timestamp=excluded.last_timestamp,
+                fingerprint=excluded.fingerprint
+            """,
+            (stream, last_timestamp, fingerprint),
         )
+
+    await _write(op)
+
+
+@_timed
+async def get_incoming_transfers(to_hexes: Iterable[str], since_ms: int) -> List[Transfer]:
+    """Return unclaimed transfers to any of ``to_hexes`` since ``since_ms``."""
+    to_hexes = list(to_hexes)
+    if not to_hexes:
+        return []
+    placeholders = ",".join("?" * len(to_hexes))
+    async with _db().execute(
+        f"""
+        SELECT tx_id, to_hex, amount_sun, block_timestamp, asset
+        FROM incoming_transfers
+        WHERE to_hex IN ({placeholders}) AND block_timestamp >= ? AND invoice_id IS NULL
+        """,
+        (*to_hexes, since_ms),
+    ) as cursor:
         rows = await cursor.fetchall()
-    invoices: List[Invoice] = []
-    for row in rows:
-        invoices.append(
-            Invoice(
-                id=row[0],
-                user_id=row[1],
-                wallet_address=row[2],
-                energy_amount=row[3],
-                base_price_trx=row[4],
-                final_price_trx=row[5],
-                unique_payment_address=row[6],
-                created_at=datetime.fromisoformat(row[7]),
-                expires_at=datetime.fromisoformat(row[8]),
-                status=row[9],
-            )
+    return [Transfer(tx_id=r[0], to_hex=r[1], amount_sun=r[2], timestamp_ms=r[3], asset=r[4]) for r in rows]
+
+
+@_timed
+async def get_pool_addresses(addresses: Iterable[str]) -> set[str]:
+    """Return which of ``addresses`` belong to the deposit address pool."""
+    addresses = list(addresses)
+    if not addresses:
+        return set()
+    placeholders = ",".join("?" * len(addresses))
+    async with _db().execute(
+        f"SELECT address FROM deposit_addresses WHERE address IN ({placeholders})", addresses
+    ) as cursor:
+        return {row[0] for row in await cursor.fetchall()}
+
+
+@_timed
+async def add_deposit_addresses(addresses: Iterable[str]) -> int:
+    """Add addresses to the deposit pool, ignoring ones already known."""
+
+    async def op(conn: aiosqlite.Connection) -> int:
+        before = conn.total_changes
+        await conn.executemany(
+            "INSERT OR IGNORE INTO deposit_addresses (address) VALUES (?)",
+            [(address,) for address in addresses],
         )
-    return invoices
+        return conn.total_changes - before
+
+    return await _write(op)
 
 
-async def mark_invoice_paid(invoice_id: int) -> None:
-    async with aiosqlite.connect(settings.database_path) as db:
-        await db.execute(
-            "UPDATE invoices SET status='paid' WHERE id=?",
-            (invoice_id,),
+@_timed
+async def save_quote(
+    quote_id: str, wallet_address: str, packages: str, created_at: float, expire_before: float
+) -> None:
+    """Store a quote and drop quotes created before ``expire_before``."""
+
+    async def op(conn: aiosqlite.Connection) -> None:
+        await conn.execute("DELETE FROM quotes WHERE created_at < ?", (expire_before,))
+        await conn.execute(
+            "INSERT INTO quotes (id, wallet_address, packages, created_at) VALUES (?, ?, ?, ?)",
+            (quote_id, wallet_address, packages, created_at),
         )
-        await db.commit()
+
+    await _write(op)
+
+
+@_timed
+async def get_quote(quote_id: str) -> Optional[tuple[str, str, float]]:
+    async with _db().execute(
+        "SELECT wallet_address, packages, created_at FROM quotes WHERE id=?",
+        (quote_id,),
+    ) as cursor:
+        row = await cursor.fetchone()
+    return (row[0], row[1], row[2]) if row else None
+
+
+@_timed
+async def get_fsm_record(key: str) -> Optional[tuple[Optional[str], str]]:
+    """Return the stored FSM state and JSON data for ``key``."""
+    async with _db().execute("SELECT state, data FROM fsm_states WHERE key=?", (key,)) as cursor:
+        row = await cursor.fetchone()
+    return (row[0], row[1]) if row else None
 
 
-async def mark_invoice_expired(invoice_id: int) -> None:
-    async with aiosqlite.connect(settings.database_path) as db:
-        await db.execute(
-            "UPDATE invoices SET status='expired' WHERE id=?",
-            (invoice_id,),
+@_timed
+async def set_fsm_state(key: str, state: Optional[str]) -> None:
+    async def op(conn: aiosqlite.Connection) -> None:
+        await conn.execute(
+            "INSERT INTO fsm_states (key, state) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET state=excluded.state",
+            (key, state),
         )
-        await db.commit()
+        await conn.execute("DELETE FROM fsm_states WHERE key=? AND state IS NULL AND data='{}'", (key,))
+
+    await _write(op)
+
+
+@_timed
+async def set_fsm_data(key: str, data: str) -> None:
+    async def op(conn: aiosqlite.Connection) -> None:
+        await conn.execute(
+            "INSERT INTO fsm_states (key, data) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET data=excluded.data",
+            (key, data),
+        )
+        await conn.execute("DELETE FROM fsm_states WHERE key=? AND state IS NULL AND data='{}'", (key,))
+
+    await _write(op)
+
+
+@_timed
+async def claim_delegation_job(lock_seconds: float) -> Optional[DelegationJob]:
+    """Take the next due delegation job and lock it for ``lock_seconds``.
+
+    A running job whose lock has expired (its worker died) is due again. The
+    lock starts when the claim is applied, not when it was queued.
+    """
+
+    async def op(conn: aiosqlite.Connection) -> Optional[DelegationJob]:
+        now = datetime.now(timezone.utc)
+        async with conn.execute(
+            """
+            SELECT id, invoice_id, idempotency_key, user_id, wallet_address,
+                   energy_amount, attempts, order_id
+            FROM delegation_jobs
+            WHERE status IN ('queued', 'running') AND next_attempt_at <= ?
+            ORDER BY next_attempt_at
+            LIMIT 1
+            """,
+            (now.isoformat(),),
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        cursor = await conn.execute(
+            """
+            UPDATE delegation_jobs
+            SET status='running', attempts=attempts + 1, next_attempt_at=?, updated_at=?
+            WHERE id=? AND status IN ('queued', 'running') AND next_attempt_at <= ?
+            """,
+            ((now + timedelta(seconds=lock_seconds)).isoformat(), now.isoformat(), row[0], now.isoformat()),
+        )
+        if cursor.rowcount != 1:
+            return None
+        return DelegationJob(
+            id=row[0],
+            invoice_id=row[1],
+            idempotency_key=row[2],
+            user_id=row[3],
+            wallet_address=row[4],
+            energy_amount=row[5],
+            attempts=row[6] + 1,
+            order_id=row[7],
+        )
+
+    return await _write(op)
+
+
+@_timed
+async def complete_delegation_job(job_id: int, order_id: Optional[str]) -> None:
+    async def op(conn: aiosqlite.Connection) -> None:
+        await conn.execute(
+            "UPDATE delegation_jobs SET status='done', order_id=?, last_error=NULL, updated_at=? WHERE id=?",
+            (order_id, datetime.now(timezone.utc).isoformat(), job_id),
+        )
+
+    await _write(op)
+
+
+@_timed
+async def fail_delegation_job(job_id: int, error: str, retry_at: Optional[datetime]) -> None:
+    """Record a failed attempt; the job is retried at ``retry_at`` or given up when None."""
+
+    async def op(conn: aiosqlite.Connection) -> None:
+        now = datetime.now(timezone.utc)
+        await conn.execute(
+            """
+            UPDATE delegation_jobs
+            SET status=?, last_error=?, next_attempt_at=?, updated_at=?
+            WHERE id=? AND status='running'
+            """,
+            (
+                "queued" if retry_at else "failed",
+                error,
+                (retry_at or now).isoformat(),
+                now.isoformat(),
+                job_id,
+            ),
+        )
+
+    await _write(op)
+
+
+@_timed
+async def next_delegation_due() -> Optional[datetime]:
+    """When the next queued job is due.
+
+    Running jobs are left out: their lock only expires when a worker died, and
+    the regular DELEGATION_POLL_SEC wake-up picks those up.
+    """
+    async with _db().execute(
+        "SELECT MIN(next_attempt_at) FROM delegation_jobs WHERE status = 'queued'"
+    ) as cursor:
+        row = await cursor.fetchone()
+    return datetime.fromisoformat(row[0]) if row and row[0] else None
+
+
+@_timed
+async def get_outstanding_orders(limit: int) -> List[TrackedOrder]:
+    """Return placed orders whose fulfilment is not final, least recently checked first."""
+    async with _db().execute(
+        """
+        SELECT id, invoice_id, user_id, wallet_address, energy_amount, order_id, updated_at
+        FROM delegation_jobs
+        WHERE status = 'done' AND order_id IS NOT NULL
+          AND (order_status IS NULL OR order_status = 'pending')
+        ORDER BY order_checked_at IS NOT NULL, order_checked_at
+        LIMIT ?
+        """,
+        (limit,),
+    ) as cursor:
+        rows = await cursor.fetchall()
+    return [
+        TrackedOrder(
+            job_id=r[0],
+            invoice_id=r[1],
+            user_id=r[2],
+            wallet_address=r[3],
+            energy_amount=r[4],
+            order_id=r[5],
+            ordered_at=datetime.fromisoformat(r[6]),
+        )
+        for r in rows
+    ]
+
+
+@_timed
+async def record_order_statuses(updates: List[tuple[TrackedOrder, str]]) -> None:
+    """Store polled order states; final states are copied onto the invoice."""
+    if not updates:
+        return
+    now = datetime.now(timezone.utc).isoformat()
+
+    async def op(conn: aiosqlite.Connection) -> None:
+        await conn.executemany(
+            "UPDATE delegation_jobs SET order_status=?, order_checked_at=? WHERE id=?",
+            [(status, now, order.job_id) for order, status in updates],
+        )
+        await conn.executemany(
+            "UPDATE invoices SET status=? WHERE id=? AND status='paid'",
+            [(status, order.invoice_id) for order, status in updates if status != "pending"],
+        )
+
+    await _write(op)
+
+
+@_timed
+async def enqueue_notification(chat_id: int, text: str) -> None:
+    now = datetime.now(timezone.utc).isoformat()
+
+    async def op(conn: aiosqlite.Connection) -> None:
+        await conn.execute(
+            "INSERT INTO outbox (chat_id, text, next_attempt_at, created_at) VALUES (?, ?, ?, ?)",
+            (chat_id, text, now, now),
+        )
+
+    await _write(op)
+
+
+@_timed
+async def get_due_notifications(limit: int) -> List[Notification]:
+    async with _db().execute(
+        """
+        SELECT id, chat_id, text, attempts FROM outbox
+        WHERE next_attempt_at <= ?
+        ORDER BY id
+        LIMIT ?
+        """,
+        (datetime.now(timezone.utc).isoformat(), limit),
+    ) as cursor:
+        rows = await cursor.fetchall()
+    return [Notification(id=r[0], chat_id=r[1], text=r[2], attempts=r[3]) for r in rows]
+
+
+@_timed
+async def next_notification_due() -> Optional[datetime]:
+    async with _db().execute("SELECT MIN(next_attempt_at) FROM outbox") as cursor:
+        row = await cursor.fetchone()
+    return datetime.fromisoformat(row[0]) if row and row[0] else None
+
+
+@_timed
+async def settle_notifications(done_ids: List[int], retries: List[tuple[int, datetime]]) -> None:
+    """Remove delivered (or abandoned) messages and push failed ones back."""
+    if not done_ids and not retries:
+        return
+
+    async def op(conn: aiosqlite.Connection) -> None:
+        await conn.executemany("DELETE FROM outbox WHERE id=?", [(i,) for i in done_ids])
+        await conn.executemany(
+            "UPDATE outbox SET attempts=attempts + 1, next_attempt_at=? WHERE id=?",
+            [(at.isoformat(), i) for i, at in retries],
+        )
+
+    await _write(op)
+
+
+@_timed
+async def acquire_lease(name: str, holder: str, ttl_seconds: float) -> bool:
+    """Take or renew the named lease for ``holder``.
+
+    The lease is granted when it is free, expired or already held by
+    ``holder``; the expiry is then pushed ``ttl_seconds`` into the future.
+    """
+    now = datetime.now(timezone.utc)
+
+    async def op(conn: aiosqlite.Connection) -> bool:
+        await conn.execute(
+            """
+            INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                holder=excluded.holder,
+                expires_at=excluded.expires_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at <= ?
+            """,
+            (name, holder, (now + timedelta(seconds=ttl_seconds)).isoformat(), now.isoformat()),
+        )
+        async with conn.execute("SELECT holder FROM leases WHERE name=?", (name,)) as cursor:
+            row = await cursor.fetchone()
+        return row is not None and row[0] == holder
+
+    return await _write(op)
+
+
+@_timed
+async def release_lease(name: str, holder: str) -> None:
+    async def op(conn: aiosqlite.Connection) -> None:
+        await conn.execute("DELETE FROM leases WHERE name=? AND holder=?", (name, holder))
+
+    await _write(op)
+
+
+async def collect_queue_depths() -> None:
+    """Refresh the queue-depth gauges; registered as a metrics collector."""
+    if _conn is None:
+        return
+    queries = {
+        "pending_invoices": "SELECT COUNT(*) FROM invoices WHERE status = 'pending'",
+        "delegation_jobs": "SELECT COUNT(*) FROM delegation_jobs WHERE status IN ('queued', 'running')",
+        "outbox": "SELECT COUNT(*) FROM outbox",
+    }
+    for queue, sql in queries.items():
+        async with _conn.execute(sql) as cursor:
+            row = await cursor.fetchone()
+        metrics.QUEUE_DEPTH.set(row[0] if row else 0, queue=queue)
+    if _writer is not None:
+        metrics.QUEUE_DEPTH.set(_writer.qsize(), queue="db_writes")
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from . import db, metrics
+from .config import settings
+from .notifier import notify
+from .tronsave_client import BUY_RESOURCE_TIMEOUT_SEC, OrderOutcomeUnknown, delegate_energy
+
+logger = logging.getLogger(__name__)
+
+_wakeup = asyncio.Event()
+_workers: List[asyncio.Task] = []
+
+# Extra lock time on top of the job timeout, so a job is never claimed again
+# while a buy-resource request from the timed-out attempt can still land.
+_LOCK_MARGIN_SEC = 30
+
+
+def notify_new_jobs() -> None:
+    """Wake idle workers after a delegation job was queued."""
+    _wakeup.set()
+
+
+def _lock_seconds() -> float:
+    return settings.delegation_job_timeout_sec + BUY_RESOURCE_TIMEOUT_SEC + _LOCK_MARGIN_SEC
+
+
+def _retry_delay(attempts: int) -> float:
+    delay = settings.delegation_retry_base_sec * (2 ** max(0, attempts - 1))
+    return min(delay, settings.delegation_retry_max_sec)
+
+
+@metrics.timed(metrics.TASK_SECONDS, task="delegation_job")
+async def _run_job(job: db.DelegationJob) -> None:
+    if job.order_id:
+        await db.complete_delegation_job(job.id, job.order_id)
+        return
+
+    order = None
+    try:
+        order = await delegate_energy(job.wallet_address, job.energy_amount)
+    except OrderOutcomeUnknown as exc:
+        await _fail_unknown_outcome(job, str(exc))
+        return
+    except Exception:  # noqa: BLE001
+        logger.exception("Delegation job %s (%s) raised", job.id, job.idempotency_key)
+
+    if order is not None:
+        order_id = order.get("orderId")
+        await db.complete_delegation_job(job.id, str(order_id) if order_id is not None else None)
+        await notify(
+            job.user_id,
+            (
+                "✅ Payment received!\n\n"
+                f"⚡ An order for {job.energy_amount} energy has been placed for:\n"
+                f"{job.wallet_address}\n"
+                "We will let you know once it is delegated."
+            ),
+        )
+        return
+
+    if job.attempts >= settings.delegation_max_attempts:
+        logger.error("Delegation job %s (%s) failed after %s attempts", job.id, job.idempotency_key, job.attempts)
+        await db.fail_delegation_job(job.id, "buy-resource order was not created", None)
+        await notify(
+            job.user_id,
+            "⚠️ We received your payment but could not delegate energy yet.\nOur team has been notified.",
+        )
+        return
+
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=_retry_delay(job.attempts))
+    logger.warning("Delegation job %s attempt %s failed; retrying at %s", job.id, job.attempts, retry_at)
+    await db.fail_delegation_job(job.id, "buy-resource order was not created", retry_at)
+
+
+async def _fail_unknown_outcome(job: db.DelegationJob, reason: str) -> None:
+    """Stop a job whose order may already exist instead of placing a second one.
+
+    tronsave.io has no client-supplied idempotency key and
+    preventDuplicateIncompleteOrders does not cover filled orders, so the job
+    is left for an operator to check against the tronsave.io order history.
+    """
+    logger.error("Delegation job %s (%s) needs manual review: %s", job.id, job.idempotency_key, reason)
+    await db.fail_delegation_job(job.id, f"buy-resource outcome unknown, check tronsave.io: {reason}", None)
+    await notify(
+        job.user_id,
+        "⚠️ We received your payment and are confirming your energy order.\nOur team has been notified.",
+    )
+
+
+async def _wait_for_work() -> None:
+    timeout = settings.delegation_poll_sec
+    due = await db.next_delegation_due()
+    if due is not None:
+        timeout = min(timeout, max(0.0, (due - datetime.now(timezone.utc)).total_seconds()))
+    try:
+        await asyncio.wait_for(_wakeup.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+    _wakeup.clear()
+
+
+async def delegation_worker(worker_id: int) -> None:
+    while True:
+        try:
+            job = await db.claim_delegation_job(_lock_seconds())
+            if job is None:
+                await _wait_for_work()
+                continue
+            logger.info("Worker %s running delegation job %s (%s)", worker_id, job.id, job.idempotency_key)
+            try:
+                await asyncio.wait_for(_run_job(job), timeout=settings.delegation_job_timeout_sec)
+            except asyncio.TimeoutError:
+                await _fail_unknown_outcome(job, "job timed out")
+        except asyncio.CancelledError:
+            raise
+        except Exception:  # noqa: BLE001
+            logger.exception("Delegation worker %s error", worker_id)
+            await asyncio.sleep(1)
+
+
+def start_delegation_workers() -> List[asyncio.Task]:
+    _workers.extend(
+        asyncio.create_task(delegation_worker(worker_id))
+        for worker_id in range(1, max(1, settings.delegation_workers) + 1)
+    )
+    return list(_workers)
+
+
+async def stop_delegation_workers() -> None:
+    """Cancel the workers and wait for them, so no order is in flight while HTTP and DB close."""
+    workers = list(_workers)
+    _workers.clear()
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
@@ -0,0 +1,49 @@
+import json
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from . import db
+
+
+def _key(key: StorageKey) -> str:
+    return ":".join(
+        str(part) if part is not None else ""
+        for part in (
+            key.bot_id,
+            key.chat_id,
+            key.user_id,
+            key.thread_id,
+            key.business_connection_id,
+            key.destiny,
+        )
+    )
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage in the bot database, shared by every process that opens it.
+
+    The default MemoryStorage keeps state per process, so behind a load
+    balancer a user's next update can reach a replica that never saw the
+    previous step.
+    """
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await db.set_fsm_state(_key(key), value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await db.get_fsm_record(_key(key))
+        return record[0] if record else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await db.set_fsm_data(_key(key), json.dumps(dict(data)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await db.get_fsm_record(_key(key))
+        return json.loads(record[1]) if record else {}
+
+    async def close(self) -> None:
+        # The connection belongs to app.db and is closed on shutdown.
+        pass
@@ -0,0 +1,342 @@
+import asyncio
+import logging
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from . import cassette, metrics
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+TRONGRID = "trongrid"
+TRONSAVE = "tronsave"
+RATES = "rates"
+
+# Returns the headers for one more attempt of a request already in flight.
+AttemptHeaders = Callable[[], Awaitable[Dict[str, str]]]
+
+_BASE_URLS: Dict[str, Callable[[], str]] = {
+    TRONGRID: lambda: settings.tron_api_base,
+    TRONSAVE: lambda: settings.tronsave_api_base,
+    RATES: lambda: settings.rate_api_base,
+}
+
+_sessions: Dict[str, aiohttp.ClientSession] = {}
+
+# Path segments that carry addresses, order ids or numbers are collapsed so
+# metric labels stay low-cardinality.
+_ID_SEGMENT = re.compile(r"^(T[1-9A-HJ-NP-Za-km-z]{25,33}|[0-9a-fA-F]{16,}|\d+|[\w-]{20,})$")
+
+
+def _endpoint_label(path: str) -> str:
+    return "/".join(":id" if _ID_SEGMENT.match(part) else part for part in path.split("/"))
+
+
+def _create_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=settings.http_pool_limit,
+        limit_per_host=settings.http_pool_limit_per_host,
+        keepalive_timeout=settings.http_keepalive_timeout_sec,
+        ttl_dns_cache=settings.http_dns_cache_ttl_sec,
+        use_dns_cache=True,
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
+def get_session(upstream: str) -> aiohttp.ClientSession:
+    """Return the long-lived session for an upstream, creating it on first use."""
+    if upstream not in _BASE_URLS:
+        raise KeyError(f"Unknown upstream {upstream!r}")
+    session = _sessions.get(upstream)
+    if session is None or session.closed:
+        session = _create_session()
+        _sessions[upstream] = session
+    return session
+
+
+class UpstreamUnavailable(aiohttp.ClientError):
+    """Raised when every endpoint of an upstream has its circuit open."""
+
+
+class _Endpoint:
+    """One base URL of an upstream with its health and circuit-breaker state.
+
+    The circuit opens after HTTP_BREAKER_FAILURES consecutive failures. Once
+    HTTP_BREAKER_COOLDOWN_SEC has passed a single probe request is let
+    through; it closes the circuit on success and re-opens it on failure.
+    """
+
+    __slots__ = ("upstream", "url", "latency", "failures", "opened_at", "probing")
+
+    def __init__(self, upstream: str, url: str) -> None:
+        self.upstream = upstream
+        self.url = url
+        self.latency = 0.0
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    def available(self, now: float) -> bool:
+        if self.opened_at is None:
+            return True
+        return not self.probing and now - self.opened_at >= settings.http_breaker_cooldown_sec
+
+    def score(self) -> float:
+        return self.latency * (1 + self.failures)
+
+    def observe(self, latency: float) -> None:
+        self.latency = latency if self.latency == 0 else 0.8 * self.latency + 0.2 * latency
+
+    def succeeded(self, latency: float) -> None:
+        self.observe(latency)
+        self.failures = 0
+        if self.opened_at is not None:
+            logger.info("Circuit closed for %s endpoint %s", self.upstream, self.url)
+            self.opened_at = None
+            metrics.UPSTREAM_CIRCUIT_OPEN.set(0, upstream=self.upstream, base_url=self.url)
+
+    def failed(self) -> None:
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= settings.http_breaker_failures:
+            if self.opened_at is None:
+                logger.warning(
+                    "Circuit opened for %s endpoint %s after %s failures", self.upstream, self.url, self.failures
+                )
+                metrics.UPSTREAM_CIRCUIT_OPEN.set(1, upstream=self.upstream, base_url=self.url)
+            self.opened_at = time.monotonic()
+
+
+_endpoints: Dict[str, Tuple[str, List[_Endpoint]]] = {}
+
+
+def endpoints(upstream: str) -> List[_Endpoint]:
+    """Endpoints configured for an upstream (comma-separated base URLs), in configured order."""
+    raw = _BASE_URLS[upstream]()
+    cached = _endpoints.get(upstream)
+    if cached is None or cached[0] != raw:
+        urls = [url.strip().rstrip("/") for url in raw.split(",") if url.strip()]
+        cached = (raw, [_Endpoint(upstream, url) for url in urls])
+        _endpoints[upstream] = cached
+    return cached[1]
+
+
+def base_url(upstream: str) -> str:
+    return endpoints(upstream)[0].url
+
+
+def _candidates(upstream: str, idempotent: bool) -> List[_Endpoint]:
+    """Usable endpoints, healthiest first.
+
+    An endpoint due for a probe goes first for idempotent requests and last
+    otherwise, so a request that must not be repeated, such as placing an
+    order, only probes a recovering endpoint when no healthy one is left.
+    """
+    now = time.monotonic()
+    usable = [endpoint for endpoint in endpoints(upstream) if endpoint.available(now)]
+    return sorted(usable, key=lambda endpoint: ((endpoint.opened_at is None) == idempotent, endpoint.score()))
+
+
+def _is_endpoint_failure(exc: BaseException) -> bool:
+    # 429 is a per-API-key quota, not node health; callers back off the key.
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status >= 500
+    return isinstance(exc, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError))
+
+
+def _describe(exc: BaseException) -> str:
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return f"HTTP {exc.status}"
+    return repr(exc)
+
+
+def _can_retry(exc: BaseException, idempotent: bool) -> bool:
+    """Whether a failed attempt may be repeated on another endpoint.
+
+    Non-idempotent requests are only repeated when the connection was never
+    established, so a buy order is not placed twice.
+    """
+    if idempotent:
+        return _is_endpoint_failure(exc)
+    return isinstance(exc, aiohttp.ClientConnectorError)
+
+
+async def start_http_clients() -> None:
+    cassette.open_cassette()
+    for upstream in _BASE_URLS:
+        get_session(upstream)
+    logger.info(
+        "HTTP clients ready (pool=%s, per_host=%s)",
+        settings.http_pool_limit,
+        settings.http_pool_limit_per_host,
+    )
+
+
+async def close_http_clients() -> None:
+    cassette.close_cassette()
+    sessions = list(_sessions.values())
+    _sessions.clear()
+    for session in sessions:
+        if not session.closed:
+            await session.close()
+
+
+async def request_json(
+    upstream: str,
+    method: str,
+    path: str,
+    *,
+    params: Dict[str, Any] | None = None,
+    json: Any = None,
+    headers: Dict[str, str] | None = None,
+    timeout: float = 15,
+    extra_attempt_headers: AttemptHeaders | None = None,
+) -> Any:
+    """Perform a request against an upstream and decode the JSON body.
+
+    Raises ``aiohttp.ClientResponseError`` for non-2xx responses and
+    ``UpstreamUnavailable`` when every endpoint's circuit is open. With
+    HTTP_CASSETTE_MODE set, exchanges are recorded to or served from the
+    cassette file instead. ``extra_attempt_headers`` supplies headers for
+    hedged and failover attempts, e.g. a freshly acquired API key; the
+    ``request_info.headers`` of a ``ClientResponseError`` are those of the
+    attempt that failed.
+    """
+    url = f"{base_url(upstream)}{path}"
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        if cassette.replaying():
+            data = await cassette.replay(upstream, method, path, url, params, json)
+            outcome = "replay"
+            return data
+
+        try:
+            status, data = await _send(
+                upstream, method, path, params, json, headers, timeout, extra_attempt_headers
+            )
+        except aiohttp.ClientResponseError as exc:
+            outcome = str(exc.status)
+            cassette.record(upstream, method, path, params, json, exc.status, time.perf_counter() - started, None)
+            raise
+        outcome = str(status)
+        cassette.record(upstream, method, path, params, json, status, time.perf_counter() - started, data)
+        return data
+    finally:
+        metrics.UPSTREAM_SECONDS.observe(
+            time.perf_counter() - started,
+            upstream=upstream,
+            method=method,
+            endpoint=_endpoint_label(path),
+            outcome=outcome,
+        )
+
+
+async def _attempt(
+    endpoint: _Endpoint,
+    method: str,
+    path: str,
+    params: Dict[str, Any] | None,
+    json: Any,
+    headers: Dict[str, str] | None,
+    timeout: float,
+) -> Tuple[int, Any]:
+    probe = endpoint.opened_at is not None
+    endpoint.probing = endpoint.probing or probe
+    started = time.perf_counter()
+    try:
+        async with get_session(endpoint.upstream).request(
+            method,
+            f"{endpoint.url}{path}",
+            params=params,
+            json=json,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+    except asyncio.CancelledError:
+        # Lost a hedge race: the time spent so far is a lower bound of its latency.
+        endpoint.observe(time.perf_counter() - started)
+        raise
+    except Exception as exc:  # noqa: BLE001
+        if _is_endpoint_failure(exc):
+            endpoint.failed()
+        else:
+            endpoint.succeeded(time.perf_counter() - started)
+        raise
+    finally:
+        if probe:
+            endpoint.probing = False
+    endpoint.succeeded(time.perf_counter() - started)
+    return resp.status, data
+
+
+async def _send(
+    upstream: str,
+    method: str,
+    path: str,
+    params: Dict[str, Any] | None,
+    json: Any,
+    headers: Dict[str, str] | None,
+    timeout: float,
+    extra_attempt_headers: AttemptHeaders | None = None,
+) -> Tuple[int, Any]:
+    """Send a request to the healthiest endpoint, failing over and hedging as configured.
+
+    GET requests still running after HTTP_HEDGE_AFTER_MS are sent once more to
+    the next endpoint and the first answer wins. Failed attempts move on to
+    the next endpoint while any are left. Every attempt after the first awaits
+    ``extra_attempt_headers`` for its own headers, so each one can take its
+    own rate-limit token.
+    """
+    idempotent = method.upper() == "GET"
+    candidates = iter(_candidates(upstream, idempotent))
+    hedge_after = settings.http_hedge_after_ms / 1000 if idempotent and settings.http_hedge_after_ms > 0 else None
+    attempts: Dict["asyncio.Task[Tuple[int, Any]]", _Endpoint] = {}
+    last_error: Optional[BaseException] = None
+
+    async def extra_attempt(endpoint: _Endpoint) -> Tuple[int, Any]:
+        attempt_headers = {**(headers or {}), **await extra_attempt_headers()} if extra_attempt_headers else headers
+        return await _attempt(endpoint, method, path, params, json, attempt_headers, timeout)
+
+    def launch(extra: bool = True) -> bool:
+        endpoint = next(candidates, None)
+        if endpoint is None:
+            return False
+        if extra:
+            task = asyncio.create_task(extra_attempt(endpoint))
+        else:
+            task = asyncio.create_task(_attempt(endpoint, method, path, params, json, headers, timeout))
+        attempts[task] = endpoint
+        return True
+
+    if not launch(extra=False):
+        raise UpstreamUnavailable(f"All {upstream} endpoints have an open circuit")
+    try:
+        while attempts:
+            done, _ = await asyncio.wait(attempts, timeout=hedge_after, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedge_after = None
+                if launch():
+                    metrics.UPSTREAM_EXTRA_ATTEMPTS.inc(upstream=upstream, reason="hedge")
+                continue
+            for task in done:
+                endpoint = attempts.pop(task)
+                exc = task.exception()
+                if exc is None:
+                    return task.result()
+                if not _can_retry(exc, idempotent):
+                    raise exc
+                logger.warning("%s %s via %s failed: %s", method, path, endpoint.url, _describe(exc))
+                last_error = exc
+            if not attempts and launch():
+                metrics.UPSTREAM_EXTRA_ATTEMPTS.inc(upstream=upstream, reason="failover")
+        raise last_error or UpstreamUnavailable(f"No {upstream} endpoint answered")
+    finally:
+        for task in attempts:
+            task.cancel()
+        if attempts:
+            await asyncio.gather(*attempts, return_exceptions=True)
@@ -27,10 +27,19 @@ BUY_ENERGY_START_KB = InlineKeyboardMarkup(
 )
 
 
-def energy_packages_kb(packages: list[tuple[int, str]]) -> InlineKeyboardMarkup:
-    """Build keyboard rows of (id, label)."""
+def energy_packages_kb(quote_id: str, packages: list[tuple[int, str]]) -> InlineKeyboardMarkup:
+    """Build keyboard rows of (id, label) bound to a stored quote."""
     inline_keyboard = [
-        [InlineKeyboardButton(text=label, callback_data=f"pkg:{pkg_id}")]
+        [InlineKeyboardButton(text=label, callback_data=f"pkg:{quote_id}:{pkg_id}")]
         for pkg_id, label in packages
     ]
     return InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
+
+
+def payment_currency_kb(quote_id: str, pkg_id: int, options: list[tuple[str, str]]) -> InlineKeyboardMarkup:
+    """Build one row per (currency, label) for paying a package of a stored quote."""
+    inline_keyboard = [
+        [InlineKeyboardButton(text=label, callback_data=f"cur:{quote_id}:{pkg_id}:{currency}")]
+        for currency, label in options
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import os
+import secrets
+import socket
+import time
+from typing import Awaitable, Callable, List
+
+from . import db
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+REPLICA_ID = settings.replica_id or f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+
+
+async def _stop(tasks: List[asyncio.Task]) -> None:
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    tasks.clear()
+
+
+async def run_as_leader(name: str, *loops: Callable[[], Awaitable[None]]) -> None:
+    """Run ``loops`` only while this replica holds the ``name`` lease.
+
+    The lease is renewed every ``LEADER_LEASE_RENEW_SEC``. If a renewal fails
+    or the lease cannot be confirmed before it would lapse, the loops are
+    cancelled so two replicas never run them at the same time. A standby
+    replica takes over at most ``LEADER_LEASE_TTL_SEC`` plus one renewal
+    interval after the leader disappears.
+    """
+    ttl = settings.leader_lease_ttl_sec
+    renew = min(settings.leader_lease_renew_sec, ttl / 2)
+    tasks: List[asyncio.Task] = []
+    held_until = 0.0
+    try:
+        while True:
+            attempted_at = time.monotonic()
+            try:
+                leader = await db.acquire_lease(name, REPLICA_ID, ttl)
+            except Exception:  # noqa: BLE001
+                logger.exception("Failed to renew the %s lease", name)
+                leader = attempted_at < held_until - renew
+            else:
+                if leader:
+                    held_until = attempted_at + ttl
+
+            if leader and not tasks:
+                logger.info("Replica %s is now leader for %s", REPLICA_ID, name)
+                tasks = [asyncio.create_task(loop()) for loop in loops]
+            elif not leader and tasks:
+                logger.warning("Replica %s lost the %s lease; stopping its loops", REPLICA_ID, name)
+                await _stop(tasks)
+            await asyncio.sleep(renew)
+    finally:
+        await _stop(tasks)
+        if held_until > time.monotonic():
+            try:
+                await db.release_lease(name, REPLICA_ID)
+            except Exception:  # noqa: BLE001
+                logger.warning("Failed to release the %s lease", name)
@@ -0,0 +1,299 @@
+import functools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * len(self.buckets)
+            self._sums[key] = 0.0
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[idx] += 1
+                break
+        self._sums[key] += value
+
+    def _samples(self) -> List[str]:
+        lines: List[str] = []
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(self._sums[key])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+_registry: List[_Metric] = []
+_collectors: List[Callable[[], Awaitable[None]]] = []
+
+UPSTREAM_SECONDS = Histogram(
+    "tgbot_upstream_request_seconds",
+    "Latency of TronGrid and tronsave.io requests.",
+    ["upstream", "method", "endpoint", "outcome"],
+)
+UPSTREAM_EXTRA_ATTEMPTS = Counter(
+    "tgbot_upstream_extra_attempts_total",
+    "Requests sent to another endpoint after a failure or as a hedge against a slow one.",
+    ["upstream", "reason"],
+)
+UPSTREAM_CIRCUIT_OPEN = Gauge(
+    "tgbot_upstream_circuit_open",
+    "1 while the circuit breaker of an upstream endpoint is open.",
+    ["upstream", "base_url"],
+)
+UPSTREAM_THROTTLED = Counter(
+    "tgbot_upstream_throttled_total",
+    "429 responses received from an upstream.",
+    ["upstream"],
+)
+RATE_LIMIT_WAIT_SECONDS = Histogram(
+    "tgbot_rate_limit_wait_seconds",
+    "Time spent waiting for the shared upstream request budget.",
+    ["upstream", "priority"],
+)
+DB_SECONDS = Histogram(
+    "tgbot_db_operation_seconds",
+    "Latency of database operations, including time queued for the writer.",
+    ["operation", "outcome"],
+)
+DB_WRITE_BATCH = Histogram(
+    "tgbot_db_write_batch_size",
+    "Writes committed per transaction by the write coalescer.",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250),
+)
+TASK_SECONDS = Histogram(
+    "tgbot_task_tick_seconds",
+    "Duration of one pass of a background loop.",
+    ["task", "outcome"],
+)
+HANDLER_SECONDS = Histogram(
+    "tgbot_handler_seconds",
+    "Latency of aiogram handlers.",
+    ["event", "handler", "outcome"],
+)
+INVOICE_EVENTS = Counter(
+    "tgbot_invoice_events_total",
+    "Invoice state transitions.",
+    ["status"],
+)
+NOTIFICATIONS = Counter(
+    "tgbot_notifications_total",
+    "Outbox messages by delivery result.",
+    ["result"],
+)
+QUEUE_DEPTH = Gauge(
+    "tgbot_queue_depth",
+    "Rows waiting in each work queue.",
+    ["queue"],
+)
+
+
+def timed(histogram: Histogram, **labels: str) -> Callable[[F], F]:
+    """Decorate a coroutine function to record its latency and outcome in ``histogram``."""
+
+    def decorator(fn: F) -> F:
+        @functools.wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await fn(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                histogram.observe(time.perf_counter() - started, outcome=outcome, **labels)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+def add_collector(collector: Callable[[], Awaitable[None]]) -> None:
+    """Register a coroutine that refreshes gauges right before each scrape."""
+    _collectors.append(collector)
+
+
+async def render() -> str:
+    for collector in _collectors:
+        try:
+            await collector()
+        except Exception:  # noqa: BLE001
+            logger.exception("Metrics collector %s failed", getattr(collector, "__name__", collector))
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Time every handler the router dispatches to."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        callback = getattr(handler_object, "callback", None)
+        name = getattr(callback, "__name__", "unknown")
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await handler(event, data)
+            outcome = "ok"
+            return result
+        finally:
+            HANDLER_SECONDS.observe(
+                time.perf_counter() - started,
+                event=type(event).__name__,
+                handler=name,
+                outcome=outcome,
+            )
+
+
+async def _metrics_view(request: web.Request) -> web.Response:
+    return web.Response(text=await render(), content_type="text/plain", charset="utf-8")
+
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def start_metrics_server() -> None:
+    """Serve ``/metrics`` on METRICS_HOST:METRICS_PORT; a port of 0 disables it.
+
+    A port that cannot be bound, e.g. taken by another replica on the same
+    host, is logged and the bot keeps running without the endpoint.
+    """
+    global _runner
+    if not settings.metrics_port or _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_view)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, settings.metrics_host, settings.metrics_port).start()
+    except OSError as exc:
+        await runner.cleanup()
+        logger.error(
+            "Metrics endpoint disabled: cannot listen on %s:%s: %s",
+            settings.metrics_host,
+            settings.metrics_port,
+            exc,
+        )
+        return
+    _runner = runner
+    logger.info("Metrics available on http://%s:%s/metrics", settings.metrics_host, settings.metrics_port)
+
+
+async def stop_metrics_server() -> None:
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
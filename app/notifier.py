@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from . import db, metrics
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+_wakeup = asyncio.Event()
+
+
+class TokenBucket:
+    """Allow ``rate`` events per second with bursts of up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+async def notify(chat_id: int, text: str) -> None:
+    """Queue a Telegram message; it is sent by the outbox sender and survives restarts."""
+    await db.enqueue_notification(chat_id, text)
+    _wakeup.set()
+
+
+def _retry_at(attempts: int) -> datetime:
+    delay = min(2 ** attempts, 300)
+    return datetime.now(timezone.utc) + timedelta(seconds=delay)
+
+
+async def _wait(timeout: float) -> None:
+    try:
+        await asyncio.wait_for(_wakeup.wait(), timeout=max(0.0, timeout))
+    except asyncio.TimeoutError:
+        pass
+    _wakeup.clear()
+
+
+@metrics.timed(metrics.TASK_SECONDS, task="outbox_sender")
+async def _send_batch(bot: Bot, bucket: TokenBucket, last_sent: Dict[int, float]) -> float:
+    """Send one batch of due messages; return how long the sender may idle afterwards."""
+    batch = await db.get_due_notifications(settings.notify_batch_size)
+    if not batch:
+        due = await db.next_notification_due()
+        if due is None:
+            return settings.notify_idle_sec
+        return min(settings.notify_idle_sec, (due - datetime.now(timezone.utc)).total_seconds())
+
+    done: List[int] = []
+    retries: List[tuple[int, datetime]] = []
+    pause = 0.0
+    next_slot = float("inf")
+    busy_chats: set[int] = set()
+    try:
+        for message in batch:
+            if message.chat_id in busy_chats:
+                continue
+            slot = last_sent.get(message.chat_id, 0.0) + settings.notify_per_chat_interval_sec
+            if slot > time.monotonic():
+                busy_chats.add(message.chat_id)
+                next_slot = min(next_slot, slot)
+                continue
+
+            await bucket.acquire()
+            last_sent[message.chat_id] = time.monotonic()
+            try:
+                await bot.send_message(message.chat_id, message.text)
+            except TelegramRetryAfter as exc:
+                logger.warning("Telegram flood limit hit; pausing outbox for %ss", exc.retry_after)
+                metrics.NOTIFICATIONS.inc(result="throttled")
+                pause = float(exc.retry_after)
+                break
+            except (TelegramForbiddenError, TelegramBadRequest) as exc:
+                logger.warning("Dropping message %s to %s: %s", message.id, message.chat_id, exc)
+                metrics.NOTIFICATIONS.inc(result="dropped")
+                done.append(message.id)
+            except Exception:  # noqa: BLE001
+                logger.exception("Failed to send message %s to %s", message.id, message.chat_id)
+                if message.attempts + 1 >= settings.notify_max_attempts:
+                    metrics.NOTIFICATIONS.inc(result="dropped")
+                    done.append(message.id)
+                else:
+                    metrics.NOTIFICATIONS.inc(result="retried")
+                    retries.append((message.id, _retry_at(message.attempts + 1)))
+            else:
+                metrics.NOTIFICATIONS.inc(result="sent")
+                done.append(message.id)
+            # Later messages to the same chat keep their order behind this one.
+            busy_chats.add(message.chat_id)
+    finally:
+        await db.settle_notifications(done, retries)
+
+    if pause:
+        await asyncio.sleep(pause)
+        return 0.0
+    if next_slot != float("inf") and not done:
+        return next_slot - time.monotonic()
+    return 0.0
+
+
+async def outbox_sender(bot: Bot) -> None:
+    bucket = TokenBucket(settings.notify_global_rate, settings.notify_global_rate)
+    last_sent: Dict[int, float] = {}
+    while True:
+        try:
+            idle = await _send_batch(bot, bucket, last_sent)
+        except Exception:  # noqa: BLE001
+            logger.exception("Error while sending queued notifications")
+            idle = 1.0
+        if idle > 0:
+            await _wait(idle)
+        if len(last_sent) > 10_000:
+            horizon = time.monotonic() - settings.notify_per_chat_interval_sec
+            for chat_id in [c for c, at in last_sent.items() if at < horizon]:
+                del last_sent[chat_id]
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from . import db, metrics
+from .config import settings
+from .notifier import notify
+from .tronsave_client import get_order_details
+
+logger = logging.getLogger(__name__)
+
+_FAILED_ORDER_STATES = {"CANCELED", "CANCELLED", "EXPIRED", "FAILED", "REFUNDED"}
+
+
+def _fulfilled_percent(order: Dict[str, Any]) -> Optional[float]:
+    percent = order.get("fulfilledPercent")
+    if percent is not None:
+        try:
+            return float(percent)
+        except (TypeError, ValueError):
+            return None
+    try:
+        total = float(order.get("resourceAmount") or 0)
+        remain = float(order.get("remainAmount") or 0)
+    except (TypeError, ValueError):
+        return None
+    if total <= 0:
+        return None
+    return max(0.0, min(100.0, (total - remain) / total * 100))
+
+
+def classify_order(order: Dict[str, Any], ordered_at: datetime, now: datetime) -> str:
+    """Map a tronsave.io order to delegated, partially_filled, failed or pending."""
+    percent = _fulfilled_percent(order) or 0.0
+    if percent >= 100:
+        return "delegated"
+    state = str(order.get("status") or "").upper()
+    timed_out = now - ordered_at >= timedelta(seconds=settings.order_fill_timeout_sec)
+    if state in _FAILED_ORDER_STATES or timed_out:
+        return "partially_filled" if percent > 0 else "failed"
+    return "pending"
+
+
+_MESSAGES = {
+    "delegated": "⚡ {energy} energy has been delegated to:\n{wallet}",
+    "partially_filled": (
+        "⚠️ Only part of your {energy} energy order could be delegated to:\n{wallet}\n"
+        "Our team has been notified."
+    ),
+    "failed": (
+        "⚠️ Your {energy} energy order for:\n{wallet}\ncould not be filled.\n"
+        "Our team has been notified."
+    ),
+}
+
+
+@metrics.timed(metrics.TASK_SECONDS, task="order_tracker")
+async def track_orders() -> None:
+    """Poll one batch of outstanding orders and record their fulfilment state."""
+    orders = await db.get_outstanding_orders(settings.order_tracker_batch_size)
+    if not orders:
+        return
+
+    semaphore = asyncio.Semaphore(max(1, settings.order_tracker_concurrency))
+
+    async def fetch(order: db.TrackedOrder) -> Optional[Dict[str, Any]]:
+        async with semaphore:
+            return await get_order_details(order.order_id)
+
+    details = await asyncio.gather(*(fetch(order) for order in orders))
+    now = datetime.now(timezone.utc)
+    updates: list[tuple[db.TrackedOrder, str]] = []
+    for order, data in zip(orders, details):
+        status = classify_order(data, order.ordered_at, now) if data else "pending"
+        updates.append((order, status))
+    await db.record_order_statuses(updates)
+
+    for order, status in updates:
+        if status == "pending":
+            continue
+        logger.info("Order %s for invoice %s is %s", order.order_id, order.invoice_id, status)
+        metrics.INVOICE_EVENTS.inc(status=status)
+        await notify(
+            order.user_id,
+            _MESSAGES[status].format(energy=order.energy_amount, wallet=order.wallet_address),
+        )
+
+
+async def order_tracker() -> None:
+    while True:
+        try:
+            await track_orders()
+        except Exception:  # noqa: BLE001
+            logger.exception("Error while tracking buy-resource orders")
+        await asyncio.sleep(settings.order_tracker_interval_sec)
@@ -1,19 +1,31 @@
 import asyncio
 import logging
-from datetime import datetime, timedelta, timezone
-from typing import Optional
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
 
-import aiohttp
 import base58
-from aiogram import Bot
 
-from . import db
+from . import db, metrics
 from .config import settings
-from .tronsave_client import delegate_energy
+from .delegation import notify_new_jobs
+from .notifier import notify
+from .ratelimit import PRIORITY_PAYMENTS
+from .reconcile import match_invoices, parse_trc20_transfers, parse_trx_transfers
+from .tron_client import USDT_CONTRACT, trongrid_json
 
 logger = logging.getLogger(__name__)
 
+_wakeup = asyncio.Event()
 
+
+def notify_new_invoice() -> None:
+    """Wake the payment watcher so a fresh invoice is polled right away."""
+    _wakeup.set()
+
+
+@lru_cache(maxsize=4096)
 def _address_hex(address: str) -> Optional[str]:
     try:
         decoded = base58.b58decode_check(address)
@@ -23,106 +35,217 @@ def _address_hex(address: str) -> Optional[str]:
     return decoded.hex()
 
 
-async def _fetch_transactions(session: aiohttp.ClientSession, address: str, since: datetime) -> list[dict]:
-    params = {
+# Cursor stream prefix and TronGrid feed per asset.
+_TRANSFER_FEEDS = {
+    db.TRX: ("trx", "/v1/accounts/{address}/transactions"),
+    db.USDT: ("trc20", "/v1/accounts/{address}/transactions/trc20"),
+}
+
+
+async def _fetch_transactions(
+    address: str, min_timestamp: int, fingerprint: Optional[str] = None, asset: str = db.TRX
+) -> dict:
+    params: dict[str, str | int] = {
         "only_to": "true",
-        "limit": 50,
-        "min_timestamp": int(since.timestamp() * 1000),
+        "limit": settings.tron_ingest_page_size,
+        "min_timestamp": min_timestamp,
+        "order_by": "block_timestamp,asc",
     }
-    headers: dict[str, str] = {}
-    if settings.tron_api_key:
-        headers["TRON-PRO-API-KEY"] = settings.tron_api_key
-
-    async with session.get(
-        f"{settings.tron_api_base.rstrip('/')}/v1/accounts/{address}/transactions",
-        params=params,
-        headers=headers,
-        timeout=aiohttp.ClientTimeout(total=20),
-    ) as resp:
-        resp.raise_for_status()
-        payload = await resp.json()
-        return payload.get("data", [])
-
-
-async def check_payment(invoice: db.Invoice, session: aiohttp.ClientSession) -> bool:
-    """Check TronGrid for incoming payments that satisfy the invoice amount."""
-    if settings.simulate_payments:
-        now = datetime.now(timezone.utc)
-        return now - invoice.created_at >= timedelta(minutes=1)
-
-    if not settings.payment_receiver_address:
-        logger.warning("PAYMENT_RECEIVER_ADDRESS is not configured; cannot check payments")
-        return False
+    if asset == db.USDT:
+        params["contract_address"] = USDT_CONTRACT
+    if fingerprint:
+        params["fingerprint"] = fingerprint
+    return await trongrid_json(
+        _TRANSFER_FEEDS[asset][1].format(address=address), params=params, priority=PRIORITY_PAYMENTS, timeout=20
+    )
+
+
+def _parse_transfers(items: List[dict], address: str, receiver_hex: str, asset: str) -> List[db.Transfer]:
+    if asset == db.USDT:
+        return parse_trc20_transfers(items, address, receiver_hex, USDT_CONTRACT)
+    return parse_trx_transfers(items, receiver_hex)
+
+
+async def ingest_transfers(address: str, receiver_hex: str, start_ms: int, asset: str = db.TRX) -> bool:
+    """Walk new TronGrid pages for ``address`` and store its incoming ``asset`` transfers.
+
+    TRX and USDT are separate cursor streams (``trx:<address>`` and
+    ``trc20:<address>``). The cursor keeps the anchor ``min_timestamp`` of the
+    current walk and the fingerprint of the next page, so an interrupted walk
+    resumes where it stopped. Once the last page is read the anchor moves to
+    the newest block timestamp seen. Returns whether the last page was reached.
+    """
+    stream = f"{_TRANSFER_FEEDS[asset][0]}:{address}"
+    cursor = await db.get_ingest_cursor(stream)
+    anchor, fingerprint = start_ms, None
+    if cursor is not None and cursor.last_timestamp >= start_ms:
+        anchor, fingerprint = cursor.last_timestamp, cursor.fingerprint
+
+    newest = anchor
+    for _ in range(settings.tron_ingest_max_pages):
+        page = await _fetch_transactions(address, anchor, fingerprint, asset)
+        transactions = page.get("data", [])
+        for tx in transactions:
+            newest = max(newest, int(tx.get("block_timestamp") or 0))
+        fingerprint = (page.get("meta") or {}).get("fingerprint") or None
+        transfers = _parse_transfers(transactions, address, receiver_hex, asset)
+        if fingerprint is None:
+            await db.save_ingested_page(stream, transfers, newest, None)
+            return True
+        await db.save_ingested_page(stream, transfers, anchor, fingerprint)
+    logger.info(
+        "%s transfer ingestion for %s paused after %s pages", asset, address, settings.tron_ingest_max_pages
+    )
+    return False
 
-    receiver_hex = _address_hex(settings.payment_receiver_address)
-    if receiver_hex is None:
-        return False
 
+async def _ingest_address(address: str, receiver_hex: str, start_ms: int, asset: str) -> bool:
     try:
-        transactions = await _fetch_transactions(session, settings.payment_receiver_address, invoice.created_at)
+        return await ingest_transfers(address, receiver_hex, start_ms, asset)
     except Exception:  # noqa: BLE001
-        logger.exception("Failed to fetch transactions for payment check")
+        logger.exception("Failed to ingest %s transactions for %s", asset, address)
         return False
 
-    for tx in transactions:
-        contracts = tx.get("raw_data", {}).get("contract", [])
-        for contract in contracts:
-            if contract.get("type") != "TransferContract":
-                continue
-            value = contract.get("parameter", {}).get("value", {})
-            to_addr_hex = value.get("to_address")
-            if isinstance(to_addr_hex, str) and to_addr_hex.startswith("0x"):
-                to_addr_hex = to_addr_hex[2:]
-            if not to_addr_hex:
-                continue
-            if to_addr_hex.lower() != receiver_hex.lower():
-                continue
-            amount_sun = value.get("amount", 0) or 0
-            amount_trx = amount_sun / 1_000_000
-            if amount_trx + 1e-8 >= invoice.final_price_trx:
-                return True
-    return False
 
+async def find_paid_invoices(
+    invoices: List[db.Invoice],
+) -> Tuple[List[Tuple[db.Invoice, Optional[str]]], Set[int]]:
+    """Ingest new transfers for every watched address and reconcile open invoices.
 
-async def handle_pending_invoices(bot: Bot, session: aiohttp.ClientSession) -> None:
-    pending = await db.get_pending_invoices()
-    now = datetime.now(timezone.utc)
-    for invoice in pending:
-        if invoice.expires_at <= now:
-            logger.info("Invoice %s expired", invoice.id)
-            await db.mark_invoice_expired(invoice.id)
-            try:
-                await bot.send_message(
-                    invoice.user_id,
-                    "❌ This invoice has expired.\nPlease create a new one.",
-                )
-            except Exception:  # noqa: BLE001
-                logger.exception("Failed to notify user %s about expiration", invoice.user_id)
-            continue
+    Also returns the ids of invoices whose address and asset feed was read to
+    its end in this pass; only those can be known to be unpaid.
+    """
+    if not invoices:
+        return [], set()
 
-        paid = await check_payment(invoice, session)
-        if paid:
-            logger.info("Invoice %s marked as paid", invoice.id)
-            await db.mark_invoice_paid(invoice.id)
-            await delegate_energy(invoice.wallet_address, invoice.energy_amount)
-            try:
-                await bot.send_message(
-                    invoice.user_id,
-                    (
-                        "✅ Payment received!\n\n"
-                        f"⚡ {invoice.energy_amount} energy has been delegated to:\n"
-                        f"{invoice.wallet_address}"
-                    ),
-                )
-            except Exception:  # noqa: BLE001
-                logger.exception("Failed to notify user %s about payment", invoice.user_id)
-
-
-async def payment_watcher(bot: Bot) -> None:
-    async with aiohttp.ClientSession() as session:
-        while True:
-            try:
-                await handle_pending_invoices(bot, session)
-            except Exception:  # noqa: BLE001
-                logger.exception("Error while checking pending invoices")
-            await asyncio.sleep(settings.payment_check_interval.total_seconds())
+    if settings.simulate_payments:
+        cutoff_ms = int(time.time() * 1000) - 60_000
+        return [(inv, None) for inv in invoices if inv.created_at_ms <= cutoff_ms], {inv.id for inv in invoices}
+
+    open_invoices: Dict[Tuple[str, str], List[db.Invoice]] = {}
+    addresses: Dict[str, str] = {}
+    # An undecodable address can never be paid, so there is nothing to wait for.
+    caught_up: Set[int] = set()
+    for invoice in invoices:
+        to_hex = _address_hex(invoice.unique_payment_address)
+        if to_hex is None:
+            caught_up.add(invoice.id)
+            continue
+        open_invoices.setdefault((to_hex, invoice.currency), []).append(invoice)
+        addresses[to_hex] = invoice.unique_payment_address
+    if not open_invoices:
+        return [], caught_up
+
+    starts = {
+        key: min(inv.created_at_ms for inv in group)
+        for key, group in open_invoices.items()
+    }
+    complete = await asyncio.gather(
+        *(
+            _ingest_address(addresses[to_hex], to_hex, start_ms, asset)
+            for (to_hex, asset), start_ms in starts.items()
+        )
+    )
+    for key, done in zip(starts, complete):
+        if done:
+            caught_up.update(inv.id for inv in open_invoices[key])
+
+    transfers = await db.get_incoming_transfers(addresses.keys(), min(starts.values()))
+    pool = await db.get_pool_addresses(addresses.values())
+    dedicated = {to_hex for to_hex, address in addresses.items() if address in pool}
+    matches = [
+        (invoice, transfer.tx_id) for invoice, transfer in match_invoices(open_invoices, transfers, dedicated)
+    ]
+    return matches, caught_up
+
+
+async def init_deposit_pool() -> None:
+    """Load pre-generated deposit addresses from DEPOSIT_ADDRESS_POOL_FILE."""
+    path = settings.deposit_address_pool_file
+    if not path:
+        return
+    with open(path, encoding="utf-8") as fh:
+        candidates = [line.strip() for line in fh if line.strip() and not line.startswith("#")]
+    addresses = [addr for addr in candidates if _address_hex(addr) is not None]
+    added = await db.add_deposit_addresses(addresses)
+    logger.info("Deposit address pool: %s loaded, %s new", len(addresses), added)
+
+
+@metrics.timed(metrics.TASK_SECONDS, task="payment_watcher")
+async def handle_pending_invoices(now: Optional[datetime] = None) -> List[db.Invoice]:
+    """Settle paid invoices, then expire overdue ones; return those still open.
+
+    Overdue invoices are reconciled before they expire, so a payment made in
+    time is honoured even when this pass runs after the deadline. An invoice
+    only expires PAYMENT_EXPIRY_GRACE_SEC after its deadline, so TronGrid has
+    indexed late blocks, and only when this pass read its transfer feed to the
+    end. ``now`` defaults to the current time; replays pass the recorded clock
+    instead.
+    """
+    now = now or datetime.now(timezone.utc)
+    open_invoices = await db.get_pending_invoices()
+    matches, caught_up = await find_paid_invoices(open_invoices)
+    paid_ids = set(await db.mark_invoices_paid([(invoice.id, tx_id) for invoice, tx_id in matches]))
+    for invoice, tx_id in matches:
+        if invoice.id in paid_ids:
+            metrics.INVOICE_EVENTS.inc(status="paid")
+            logger.info("Invoice %s marked as paid by %s; delegation queued", invoice.id, tx_id)
+        else:
+            logger.warning("Invoice %s or transfer %s was already settled; skipping", invoice.id, tx_id)
+    if paid_ids:
+        notify_new_jobs()
+
+    expire_before_ms = int(now.timestamp() * 1000) - int(settings.payment_expiry_grace_sec * 1000)
+    overdue = [
+        invoice.id
+        for invoice in open_invoices
+        if invoice.id in caught_up and invoice.id not in paid_ids and invoice.expires_at_ms <= expire_before_ms
+    ]
+    expired_ids = set()
+    for invoice_id, user_id in await db.expire_invoices(overdue):
+        expired_ids.add(invoice_id)
+        logger.info("Invoice %s expired", invoice_id)
+        metrics.INVOICE_EVENTS.inc(status="expired")
+        await notify(user_id, "❌ This invoice has expired.\nPlease create a new one.")
+    return [invoice for invoice in open_invoices if invoice.id not in paid_ids and invoice.id not in expired_ids]
+
+
+def _poll_interval(age_sec: float) -> float:
+    """Poll young invoices fast and double the interval every backoff step."""
+    steps = int(max(0.0, age_sec) // max(1.0, settings.payment_poll_backoff_sec))
+    ceiling = settings.payment_check_interval.total_seconds()
+    return min(ceiling, settings.payment_poll_min_sec * 2 ** min(steps, 16))
+
+
+def next_check_delay(open_invoices: List[db.Invoice], now_ms: int) -> Optional[float]:
+    """Seconds until the next check, or None to wait for a new invoice."""
+    if not open_invoices:
+        return settings.payment_idle_recheck_sec or None
+    youngest_ms = max(inv.created_at_ms for inv in open_invoices)
+    poll = _poll_interval((now_ms - youngest_ms) / 1000)
+    # Wake just after the earliest grace period ends so the expiry is reported
+    # on time; invoices already past it wait for their feed to be caught up.
+    grace_ms = int(settings.payment_expiry_grace_sec * 1000)
+    deadlines = [inv.expires_at_ms + grace_ms for inv in open_invoices if inv.expires_at_ms + grace_ms > now_ms]
+    if not deadlines:
+        return poll
+    return max(0.0, min(poll, (min(deadlines) - now_ms) / 1000 + 0.01))
+
+
+async def _sleep(timeout: Optional[float]) -> None:
+    try:
+        await asyncio.wait_for(_wakeup.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+    _wakeup.clear()
+
+
+async def payment_watcher() -> None:
+    while True:
+        try:
+            open_invoices = await handle_pending_invoices()
+            delay = next_check_delay(open_invoices, int(time.time() * 1000))
+        except Exception:  # noqa: BLE001
+            logger.exception("Error while checking pending invoices")
+            delay = settings.payment_check_interval.total_seconds()
+        await _sleep(delay)
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Any, List, Optional
+
+from .config import settings
+from .tronsave_client import (
+    ENERGY_PRESETS,
+    EnergyPackage,
+    estimate_buy_resource,
+    get_energy_packages,
+    get_order_book,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class OrderBook:
+    """Price depth of the tronsave.io order book, cheapest level first.
+
+    ``cumulative_amount[i]`` and ``cumulative_cost_sun[i]`` hold the energy and
+    SUN needed to buy every level up to and including ``prices[i]``, so the
+    cost of any amount is one binary search plus a partial level.
+    """
+
+    prices: List[int]
+    cumulative_amount: List[int]
+    cumulative_cost_sun: List[int]
+    fetched_at: float
+
+    @classmethod
+    def from_levels(cls, levels: List[dict[str, Any]], fetched_at: float) -> "OrderBook":
+        parsed = []
+        for level in levels:
+            try:
+                price = int(level.get("price") or 0)
+                amount = int(level.get("availableResourceAmount") or 0)
+            except (TypeError, ValueError):
+                continue
+            if price > 0 and amount > 0:
+                parsed.append((price, amount))
+        parsed.sort()
+
+        prices: List[int] = []
+        cumulative_amount: List[int] = []
+        cumulative_cost: List[int] = []
+        total_amount = total_cost = 0
+        for price, amount in parsed:
+            total_amount += amount
+            total_cost += price * amount
+            prices.append(price)
+            cumulative_amount.append(total_amount)
+            cumulative_cost.append(total_cost)
+        return cls(prices, cumulative_amount, cumulative_cost, fetched_at)
+
+    @property
+    def depth(self) -> int:
+        return self.cumulative_amount[-1] if self.cumulative_amount else 0
+
+    def cost_sun(self, amount: int) -> Optional[int]:
+        """Cost of filling ``amount`` energy from the cheapest levels, or None if too shallow."""
+        if amount <= 0:
+            return 0
+        idx = bisect_left(self.cumulative_amount, amount)
+        if idx >= len(self.prices):
+            return None
+        filled_amount = self.cumulative_amount[idx - 1] if idx else 0
+        filled_cost = self.cumulative_cost_sun[idx - 1] if idx else 0
+        return filled_cost + (amount - filled_amount) * self.prices[idx]
+
+    def marginal_price(self, amount: int) -> Optional[int]:
+        idx = bisect_left(self.cumulative_amount, max(1, amount))
+        return self.prices[idx] if idx < len(self.prices) else None
+
+
+_book: Optional[OrderBook] = None
+
+
+def current_book() -> Optional[OrderBook]:
+    """Return the order book if it is recent enough to price from."""
+    if _book is None:
+        return None
+    if time.time() - _book.fetched_at > settings.order_book_max_age_sec:
+        return None
+    return _book
+
+
+async def refresh_order_book() -> bool:
+    global _book
+    data = await get_order_book(
+        settings.payment_receiver_address or None,
+        min_delegate_amount=settings.tronsave_min_delegate_amount,
+        duration_sec=settings.tronsave_duration_sec,
+    )
+    if isinstance(data, dict):
+        data = data.get("orders")
+    if not isinstance(data, list) or not data:
+        return False
+    _book = OrderBook.from_levels(data, time.time())
+    logger.debug("Order book refreshed: %s levels, depth %s", len(_book.prices), _book.depth)
+    return True
+
+
+async def order_book_refresher() -> None:
+    while True:
+        try:
+            await refresh_order_book()
+        except Exception:  # noqa: BLE001
+            logger.exception("Error while refreshing the order book")
+        await asyncio.sleep(settings.order_book_refresh_sec)
+
+
+def quote_energy_trx(amount: int) -> Optional[float]:
+    """Price any energy amount locally; None when the book is stale or too shallow."""
+    book = current_book()
+    if book is None:
+        return None
+    cost = book.cost_sun(amount)
+    return None if cost is None else cost / 1_000_000
+
+
+def price_packages(amounts: List[int]) -> Optional[List[EnergyPackage]]:
+    """Price every preset from the order book, or None if any of them cannot be priced."""
+    book = current_book()
+    if book is None:
+        return None
+    packages: List[EnergyPackage] = []
+    for idx, amount in enumerate(amounts, start=1):
+        cost = book.cost_sun(amount)
+        if cost is None:
+            return None
+        packages.append(
+            EnergyPackage(
+                id=idx,
+                energy_amount=amount,
+                base_price_trx=cost / 1_000_000,
+                unit_price=book.marginal_price(amount) or settings.tronsave_unit_price,
+            )
+        )
+    return packages
+
+
+async def get_packages(receiver_address: str) -> List[EnergyPackage]:
+    """Price the presets from the local order book, falling back to tronsave.io estimates."""
+    if settings.pricing_engine_enabled:
+        packages = price_packages(ENERGY_PRESETS)
+        if packages is not None:
+            return packages
+        logger.info("Order book unavailable; estimating packages via tronsave.io")
+    return await get_energy_packages(receiver_address)
+
+
+async def verify_package_price(pkg: EnergyPackage, receiver_address: str) -> bool:
+    """Check a quoted package against a live estimate before invoicing.
+
+    Returns False only when tronsave.io now asks noticeably more than quoted;
+    an unavailable estimate does not block the sale.
+    """
+    estimate = await estimate_buy_resource(resource_amount=pkg.energy_amount, receiver=receiver_address)
+    if not estimate:
+        return True
+    live_trx = (estimate.get("estimateTrx") or 0) / 1_000_000
+    limit = pkg.base_price_trx * (1 + settings.pricing_verify_tolerance_percent / 100)
+    if live_trx > limit:
+        logger.info(
+            "Quoted %.6f TRX for %s energy, live estimate is %.6f",
+            pkg.base_price_trx,
+            pkg.energy_amount,
+            live_trx,
+        )
+        return False
+    return True
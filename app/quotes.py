@@ -0,0 +1,71 @@
+import json
+import logging
+import secrets
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+from . import db
+from .cache import TTLCache
+from .config import settings
+from .tronsave_client import EnergyPackage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Quote:
+    id: str
+    wallet_address: str
+    packages: Dict[int, EnergyPackage]
+    created_at: float
+
+
+_quotes: TTLCache[str, Quote] = TTLCache(maxsize=settings.quote_cache_size, ttl=settings.quote_ttl_sec)
+
+
+async def save_quote(wallet_address: str, packages: List[EnergyPackage]) -> Quote:
+    """Remember the packages shown to a user so selection needs no re-estimate."""
+    quote = Quote(
+        id=secrets.token_urlsafe(6),
+        wallet_address=wallet_address,
+        packages={pkg.id: pkg for pkg in packages},
+        created_at=time.time(),
+    )
+    _quotes.set(quote.id, quote)
+    if settings.quote_persist:
+        payload = json.dumps([asdict(pkg) for pkg in packages])
+        await db.save_quote(
+            quote.id,
+            wallet_address,
+            payload,
+            quote.created_at,
+            expire_before=quote.created_at - settings.quote_ttl_sec,
+        )
+    return quote
+
+
+async def get_quote(quote_id: str) -> Optional[Quote]:
+    quote = _quotes.get(quote_id)
+    if quote is not None or not settings.quote_persist:
+        return quote
+
+    row = await db.get_quote(quote_id)
+    if row is None:
+        return None
+    wallet_address, payload, created_at = row
+    if created_at + settings.quote_ttl_sec <= time.time():
+        return None
+    try:
+        packages = [EnergyPackage(**item) for item in json.loads(payload)]
+    except (TypeError, ValueError):
+        logger.warning("Stored quote %s is malformed", quote_id)
+        return None
+    quote = Quote(
+        id=quote_id,
+        wallet_address=wallet_address,
+        packages={pkg.id: pkg for pkg in packages},
+        created_at=created_at,
+    )
+    _quotes.set(quote_id, quote)
+    return quote
@@ -0,0 +1,100 @@
+import asyncio
+import heapq
+import itertools
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+# Lower value is served first.
+PRIORITY_PAYMENTS = 0
+PRIORITY_PREVIEW = 1
+
+
+@dataclass(slots=True)
+class _Bucket:
+    key: str
+    tokens: float
+    updated: float
+    blocked_until: float = 0.0
+
+
+class KeyedRateLimiter:
+    """Token buckets for a set of API keys shared by every caller in the process.
+
+    ``acquire`` hands out the key with the most tokens left, which spreads load
+    across keys. When no key has a token, callers wait in priority order and
+    then FIFO. A key that was throttled upstream can be paused with
+    ``backoff`` until its Retry-After has passed.
+    """
+
+    def __init__(self, keys: Sequence[str], rate: float, burst: float) -> None:
+        self.rate = max(rate, 0.001)
+        self.burst = max(burst, 1.0)
+        now = time.monotonic()
+        self._buckets = [_Bucket(key, self.burst, now) for key in keys] or [_Bucket("", self.burst, now)]
+        self._waiters: List[Tuple[int, int, "asyncio.Future[str]"]] = []
+        self._seq = itertools.count()
+        self._pump: Optional["asyncio.Task[None]"] = None
+
+    @property
+    def keys(self) -> List[str]:
+        return [bucket.key for bucket in self._buckets]
+
+    def _refill(self, now: float) -> None:
+        for bucket in self._buckets:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+
+    def _take(self, now: float) -> Tuple[Optional[str], float]:
+        """Take a token from the fullest usable key, or return how long until one is due."""
+        self._refill(now)
+        usable = [bucket for bucket in self._buckets if bucket.blocked_until <= now]
+        best = max(usable, key=lambda bucket: bucket.tokens, default=None)
+        if best is not None and best.tokens >= 1:
+            best.tokens -= 1
+            return best.key, 0.0
+        waits = [
+            max(bucket.blocked_until - now, (1 - bucket.tokens) / self.rate) for bucket in self._buckets
+        ]
+        return None, max(min(waits), 0.001)
+
+    async def acquire(self, priority: int = PRIORITY_PREVIEW) -> str:
+        """Wait for a request slot and return the API key to use for it."""
+        if not self._waiters:
+            key, _ = self._take(time.monotonic())
+            if key is not None:
+                return key
+        future: "asyncio.Future[str]" = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._serve_waiters())
+        return await future
+
+    async def _serve_waiters(self) -> None:
+        while self._waiters:
+            if self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+                continue
+            key, wait = self._take(time.monotonic())
+            if key is None:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                # Cancelled while queued; hand the token back.
+                self._give_back(key)
+            else:
+                future.set_result(key)
+
+    def _give_back(self, key: str) -> None:
+        for bucket in self._buckets:
+            if bucket.key == key:
+                bucket.tokens = min(self.burst, bucket.tokens + 1)
+
+    def backoff(self, key: str, seconds: float) -> None:
+        """Stop handing out ``key`` for ``seconds`` and drain its bucket."""
+        until = time.monotonic() + seconds
+        for bucket in self._buckets:
+            if bucket.key == key:
+                bucket.blocked_until = max(bucket.blocked_until, until)
+                bucket.tokens = 0.0
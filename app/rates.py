@@ -0,0 +1,58 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from .config import settings
+from .http import RATES, request_json
+
+logger = logging.getLogger(__name__)
+
+# Binance-compatible ticker; ``price`` is USDT per TRX.
+TICKER_PATH = "/api/v3/ticker/price"
+TICKER_SYMBOL = "TRXUSDT"
+
+_rate: Optional[float] = None
+_fetched_at = 0.0
+
+
+def trx_usdt_rate() -> Optional[float]:
+    """USDT per TRX from memory, or None when no recent rate is known.
+
+    A fixed TRX_USDT_RATE takes precedence over the fetched one. This never
+    performs I/O, so pricing an invoice does not wait on the rate source.
+    """
+    if settings.trx_usdt_rate > 0:
+        return settings.trx_usdt_rate
+    if _rate is None or time.time() - _fetched_at > settings.rate_max_age_sec:
+        return None
+    return _rate
+
+
+def sun_to_usdt_units(amount_sun: int, rate: float) -> int:
+    """Convert SUN to 10^-6 USDT; both assets use six decimals."""
+    return round(amount_sun * rate)
+
+
+async def refresh_rate() -> bool:
+    global _rate, _fetched_at
+    data = await request_json(RATES, "GET", TICKER_PATH, params={"symbol": TICKER_SYMBOL}, timeout=10)
+    try:
+        rate = float(data["price"])
+    except (KeyError, TypeError, ValueError):
+        logger.warning("Unexpected TRX/USDT ticker payload: %s", data)
+        return False
+    if rate <= 0:
+        return False
+    _rate, _fetched_at = rate, time.time()
+    logger.debug("TRX/USDT rate refreshed: %s", rate)
+    return True
+
+
+async def rate_refresher() -> None:
+    while True:
+        try:
+            await refresh_rate()
+        except Exception:  # noqa: BLE001
+            logger.exception("Error while refreshing the TRX/USDT rate")
+        await asyncio.sleep(settings.rate_refresh_sec)
@@ -0,0 +1,108 @@
+from typing import AbstractSet, Dict, Iterable, List, Tuple
+
+from .db import USDT, Invoice, Transfer
+
+
+def _normalize_hex(value: str) -> str:
+    if value.startswith("0x"):
+        value = value[2:]
+    return value.lower()
+
+
+def parse_trx_transfers(transactions: Iterable[dict], receiver_hex: str) -> List[Transfer]:
+    """Extract native TRX transfers to ``receiver_hex`` from TronGrid transactions."""
+    receiver = _normalize_hex(receiver_hex)
+    transfers: List[Transfer] = []
+    for tx in transactions:
+        raw_data = tx.get("raw_data", {})
+        timestamp_ms = tx.get("block_timestamp") or raw_data.get("timestamp") or 0
+        for contract in raw_data.get("contract", []):
+            if contract.get("type") != "TransferContract":
+                continue
+            value = contract.get("parameter", {}).get("value", {})
+            to_addr_hex = value.get("to_address")
+            if not isinstance(to_addr_hex, str) or not to_addr_hex:
+                continue
+            if _normalize_hex(to_addr_hex) != receiver:
+                continue
+            transfers.append(
+                Transfer(
+                    tx_id=tx.get("txID", ""),
+                    to_hex=receiver,
+                    amount_sun=int(value.get("amount", 0) or 0),
+                    timestamp_ms=int(timestamp_ms),
+                )
+            )
+    return transfers
+
+
+def parse_trc20_transfers(
+    transfers: Iterable[dict], receiver_address: str, receiver_hex: str, contract: str
+) -> List[Transfer]:
+    """Extract USDT transfers to ``receiver_address`` from TronGrid's TRC20 feed.
+
+    Only ``Transfer`` events of the ``contract`` token count; the feed reports
+    addresses in base58, the stored transfer keeps the receiver in hex like
+    TRX transfers do.
+    """
+    receiver = _normalize_hex(receiver_hex)
+    parsed: List[Transfer] = []
+    for item in transfers:
+        if item.get("type") != "Transfer" or item.get("to") != receiver_address:
+            continue
+        if (item.get("token_info") or {}).get("address") != contract:
+            continue
+        try:
+            amount = int(item.get("value") or 0)
+        except (TypeError, ValueError):
+            continue
+        parsed.append(
+            Transfer(
+                tx_id=item.get("transaction_id", ""),
+                to_hex=receiver,
+                amount_sun=amount,
+                timestamp_ms=int(item.get("block_timestamp") or 0),
+                asset=USDT,
+            )
+        )
+    return parsed
+
+
+def match_invoices(
+    open_invoices: Dict[Tuple[str, str], List[Invoice]],
+    transfers: Iterable[Transfer],
+    dedicated: AbstractSet[str] = frozenset(),
+) -> List[Tuple[Invoice, Transfer]]:
+    """Pair open invoices with the transfers that paid them.
+
+    ``open_invoices`` maps each watched receiver (hex) and currency to its open
+    invoices, so a transfer to any other address, or in another asset, is
+    dropped with one set lookup. A deposit-pool address (hex in ``dedicated``)
+    with a single open invoice in a currency accepts any transfer covering the
+    payable amount; every other address, including the shared receiver, needs
+    the exact amount, which is unique per open invoice. Only transfers made
+    while an invoice was open count. Matched invoices leave the index, so one
+    transfer never pays two invoices within the same pass.
+    """
+    by_address: Dict[Tuple[str, str], Dict[int, Invoice]] = {
+        key: {inv.payable_amount_sun: inv for inv in invoices}
+        for key, invoices in open_invoices.items()
+    }
+    matches: List[Tuple[Invoice, Transfer]] = []
+    for transfer in sorted(transfers, key=lambda t: t.timestamp_ms):
+        by_amount = by_address.get((transfer.to_hex, transfer.asset))
+        if not by_amount:
+            continue
+        if transfer.to_hex in dedicated and len(by_amount) == 1:
+            invoice = next(iter(by_amount.values()))
+            if transfer.amount_sun < invoice.payable_amount_sun:
+                continue
+        else:
+            invoice = by_amount.get(transfer.amount_sun)
+            if invoice is None:
+                continue
+        if not invoice.created_at_ms <= transfer.timestamp_ms <= invoice.expires_at_ms:
+            continue
+        del by_amount[invoice.payable_amount_sun]
+        matches.append((invoice, transfer))
+    return matches
@@ -1,56 +1,182 @@
+import asyncio
 import logging
-from typing import Any, Dict
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterable, List, Optional
 
 import aiohttp
 
+from . import metrics
+from .cache import SingleFlight, TTLCache
 from .config import settings
+from .http import TRONGRID, request_json
+from .ratelimit import PRIORITY_PAYMENTS, PRIORITY_PREVIEW, KeyedRateLimiter
 
 logger = logging.getLogger(__name__)
 
 USDT_CONTRACT = "TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t"
 
+_balances: TTLCache[str, Dict[str, Any]] = TTLCache(
+    maxsize=settings.balance_cache_size, ttl=settings.balance_cache_ttl_sec
+)
+_balance_fetches: SingleFlight[str, Dict[str, Any]] = SingleFlight()
 
-async def _request_json(session: aiohttp.ClientSession, url: str) -> Dict[str, Any]:
-    headers: dict[str, str] = {}
-    if settings.tron_api_key:
-        headers["TRON-PRO-API-KEY"] = settings.tron_api_key
-    async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=15)) as resp:
-        resp.raise_for_status()
-        return await resp.json()
+
+_PRIORITY_NAMES = {PRIORITY_PAYMENTS: "payments", PRIORITY_PREVIEW: "preview"}
+_DEFAULT_RETRY_AFTER_SEC = 1.0
+_API_KEY_HEADER = "TRON-PRO-API-KEY"
+_limiter: Optional[KeyedRateLimiter] = None
+
+
+def _api_keys() -> List[str]:
+    raw = settings.tron_api_keys or settings.tron_api_key
+    return [key.strip() for key in raw.split(",") if key.strip()] or [""]
+
+
+def get_limiter() -> KeyedRateLimiter:
+    """The process-wide TronGrid limiter, rebuilt when the configured keys change."""
+    global _limiter
+    keys = _api_keys()
+    if _limiter is None or _limiter.keys != keys:
+        _limiter = KeyedRateLimiter(keys, settings.tron_rate_per_key, settings.tron_rate_burst)
+    return _limiter
+
+
+def _retry_after(exc: aiohttp.ClientResponseError) -> float:
+    value = exc.headers.get("Retry-After") if exc.headers else None
+    if not value:
+        return _DEFAULT_RETRY_AFTER_SEC
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return _DEFAULT_RETRY_AFTER_SEC
+
+
+async def trongrid_json(
+    path: str,
+    *,
+    params: Dict[str, Any] | None = None,
+    priority: int = PRIORITY_PREVIEW,
+    timeout: float = 15,
+) -> Dict[str, Any]:
+    """GET a TronGrid path within the shared per-key request budget.
+
+    A 429 pauses the throttled key for its Retry-After and the request is
+    retried with the next key that has budget left. The throttled key is the
+    one the failing attempt sent, which differs from the first one when a
+    hedged or failover attempt was throttled.
+    """
+    limiter = get_limiter()
+    retries_left = len(limiter.keys)
+
+    async def acquire_headers() -> Dict[str, str]:
+        started = time.perf_counter()
+        key = await limiter.acquire(priority)
+        metrics.RATE_LIMIT_WAIT_SECONDS.observe(
+            time.perf_counter() - started, upstream=TRONGRID, priority=_PRIORITY_NAMES.get(priority, str(priority))
+        )
+        return {_API_KEY_HEADER: key} if key else {}
+
+    while True:
+        headers = await acquire_headers()
+        key = headers.get(_API_KEY_HEADER, "")
+        try:
+            # Hedged and failover attempts take their own token instead of reusing this one.
+            return await request_json(
+                TRONGRID,
+                "GET",
+                path,
+                params=params,
+                headers=headers,
+                timeout=timeout,
+                extra_attempt_headers=acquire_headers,
+            )
+        except aiohttp.ClientResponseError as exc:
+            if exc.status != 429:
+                raise
+            throttled = exc.request_info.headers.get(_API_KEY_HEADER, key)
+            if throttled not in limiter.keys:
+                throttled = key
+            delay = _retry_after(exc)
+            metrics.UPSTREAM_THROTTLED.inc(upstream=TRONGRID)
+            logger.warning(
+                "TronGrid throttled API key #%s; pausing it for %.1fs", limiter.keys.index(throttled), delay
+            )
+            limiter.backoff(throttled, delay)
+            if retries_left <= 0:
+                raise
+            retries_left -= 1
+
+
+async def _request_json(path: str) -> Dict[str, Any]:
+    return await trongrid_json(path, priority=PRIORITY_PREVIEW)
 
 
 async def get_tron_balances(address: str) -> Dict[str, Any]:
-    """Fetch balances and resource limits for a TRON address via TronGrid."""
+    """Return balances and resource limits for a TRON address.
+
+    Results are cached for BALANCE_CACHE_TTL_SEC and concurrent lookups of the
+    same address share a single TronGrid fetch.
+    """
+    cached = _balances.get(address)
+    if cached is not None:
+        return cached
+    balances = await _balance_fetches.do(address, lambda: _fetch_balances(address))
+    _balances.set(address, balances)
+    return balances
+
+
+async def get_many_tron_balances(addresses: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """Look up many addresses at once; addresses that fail map to None."""
+    unique = list(dict.fromkeys(addresses))
+    semaphore = asyncio.Semaphore(max(1, settings.balance_batch_concurrency))
+
+    async def fetch(address: str) -> Optional[Dict[str, Any]]:
+        async with semaphore:
+            try:
+                return await get_tron_balances(address)
+            except Exception:  # noqa: BLE001
+                logger.exception("Failed to fetch balances for %s", address)
+                return None
+
+    results = await asyncio.gather(*(fetch(address) for address in unique))
+    return dict(zip(unique, results))
+
+
+async def _fetch_balances(address: str) -> Dict[str, Any]:
     logger.info("Fetching balances for %s", address)
-    async with aiohttp.ClientSession(base_url=settings.tron_api_base.rstrip("/")) as session:
-        account_url = f"/v1/accounts/{address}"
-        resources_url = f"/v1/accounts/{address}/resources"
-        account_data = await _request_json(session, account_url)
-        resources_data = await _request_json(session, resources_url)
-
-        account = (account_data.get("data") or [{}])[0]
-        raw_trx = account.get("balance", 0) or 0
-        trx_balance = raw_trx / 1_000_000
-
-        trc20_list = account.get("trc20") or []
-        usdt_balance = 0.0
-        for token in trc20_list:
-            if USDT_CONTRACT in token:
-                try:
-                    usdt_balance = float(token[USDT_CONTRACT]) / 1_000_000
-                except (TypeError, ValueError):
-                    logger.warning("Unexpected USDT balance format for %s", address)
-                break
-
-        resources = (resources_data.get("data") or [{}])[0]
-        free_bandwidth = resources.get("freeNetRemaining", 0) or 0
-        paid_bandwidth = resources.get("netRemaining", 0) or 0
-        bandwidth = free_bandwidth + paid_bandwidth
-        energy = resources.get("energyRemaining", 0) or 0
-
-        return {
-            "usdt": round(usdt_balance, 2),
-            "trx": round(trx_balance, 4),
-            "bandwidth": int(bandwidth),
-            "energy": int(energy),
-        }
+    account_data, resources_data = await asyncio.gather(
+        _request_json(f"/v1/accounts/{address}"),
+        _request_json(f"/v1/accounts/{address}/resources"),
+    )
+
+    account = (account_data.get("data") or [{}])[0]
+    raw_trx = account.get("balance", 0) or 0
+    trx_balance = raw_trx / 1_000_000
+
+    trc20_list = account.get("trc20") or []
+    usdt_balance = 0.0
+    for token in trc20_list:
+        if USDT_CONTRACT in token:
+            try:
+                usdt_balance = float(token[USDT_CONTRACT]) / 1_000_000
+            except (TypeError, ValueError):
+                logger.warning("Unexpected USDT balance format for %s", address)
+            break
+
+    resources = (resources_data.get("data") or [{}])[0]
+    free_bandwidth = resources.get("freeNetRemaining", 0) or 0
+    paid_bandwidth = resources.get("netRemaining", 0) or 0
+    bandwidth = free_bandwidth + paid_bandwidth
+    energy = resources.get("energyRemaining", 0) or 0
+
+    return {
+        "usdt": round(usdt_balance, 2),
+        "trx": round(trx_balance, 4),
+        "bandwidth": int(bandwidth),
+        "energy": int(energy),
+    }
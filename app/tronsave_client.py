@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from dataclasses import dataclass
 from typing import Any, Dict, List
@@ -5,11 +6,14 @@ from typing import Any, Dict, List
 import aiohttp
 
 from .config import settings
+from .http import TRONSAVE, UpstreamUnavailable, request_json
 
 logger = logging.getLogger(__name__)
 
 
-_ENERGY_PRESETS = [65_000, 131_000, 262_000, 393_000, 524_000, 655_000]
+ENERGY_PRESETS = [65_000, 131_000, 262_000, 393_000, 524_000, 655_000]
+_FALLBACK_PRICES_TRX = [2.21, 4.45, 8.91, 13.36, 17.82, 22.27]
+BUY_RESOURCE_TIMEOUT_SEC = 20
 
 
 def _headers() -> dict[str, str]:
@@ -25,14 +29,12 @@ class EnergyPackage:
     energy_amount: int
     base_price_trx: float
     unit_price: str | int
+    is_fallback: bool = False
 
 
-async def _get_account_info(session: aiohttp.ClientSession) -> Dict[str, Any] | None:
-    url = f"{settings.tronsave_api_base.rstrip('/')}/v2/user-info"
+async def get_account_info() -> Dict[str, Any] | None:
     try:
-        async with session.get(url, headers=_headers(), timeout=aiohttp.ClientTimeout(total=15)) as resp:
-            resp.raise_for_status()
-            data = await resp.json()
+        data = await request_json(TRONSAVE, "GET", "/v2/user-info", headers=_headers(), timeout=15)
     except Exception:  # noqa: BLE001
         logger.exception("Failed to fetch tronsave.io account info")
         return None
@@ -43,32 +45,25 @@ async def _get_account_info(session: aiohttp.ClientSession) -> Dict[str, Any] |
     return data.get("data")
 
 
-async def get_account_info() -> Dict[str, Any] | None:
-    async with aiohttp.ClientSession() as session:
-        return await _get_account_info(session)
-
-
 async def get_order_book(
-    receiver: str,
+    receiver: str | None,
     *,
     min_delegate_amount: int | None = None,
     duration_sec: int | None = None,
     resource_type: str = "ENERGY",
 ) -> Dict[str, Any] | None:
-    url = f"{settings.tronsave_api_base.rstrip('/')}/v2/order-book"
-    params: dict[str, Any] = {"address": receiver, "resourceType": resource_type}
+    params: dict[str, Any] = {"resourceType": resource_type}
+    if receiver:
+        params["address"] = receiver
     if min_delegate_amount:
         params["minDelegateAmount"] = min_delegate_amount
     if duration_sec:
         params["durationSec"] = duration_sec
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                url, params=params, headers=_headers(), timeout=aiohttp.ClientTimeout(total=15)
-            ) as resp:
-                resp.raise_for_status()
-                payload = await resp.json()
+        payload = await request_json(
+            TRONSAVE, "GET", "/v2/order-book", params=params, headers=_headers(), timeout=15
+        )
     except Exception:  # noqa: BLE001
         logger.exception("Failed to fetch tronsave.io order book")
         return None
@@ -79,8 +74,7 @@ async def get_order_book(
     return payload.get("data")
 
 
-async def _estimate_with_session(
-    session: aiohttp.ClientSession,
+async def _estimate(
     *,
     resource_amount: int,
     receiver: str,
@@ -89,7 +83,6 @@ async def _estimate_with_session(
     allow_partial_fill: bool,
     min_delegate_amount: int,
 ) -> dict[str, Any]:
-    url = f"{settings.tronsave_api_base.rstrip('/')}/v2/estimate-buy-resource"
     payload: dict[str, Any] = {
         "resourceType": "ENERGY",
         "receiver": receiver,
@@ -102,14 +95,9 @@ async def _estimate_with_session(
         },
     }
 
-    async with session.post(
-        url,
-        json=payload,
-        headers=_headers(),
-        timeout=aiohttp.ClientTimeout(total=15),
-    ) as resp:
-        resp.raise_for_status()
-        data = await resp.json()
+    data = await request_json(
+        TRONSAVE, "POST", "/v2/estimate-buy-resource", json=payload, headers=_headers(), timeout=15
+    )
 
     if data.get("error"):
         raise RuntimeError(data.get("message", "Unknown tronsave.io estimate error"))
@@ -131,75 +119,89 @@ async def estimate_buy_resource(
     min_delegate = min_delegate_amount or settings.tronsave_min_delegate_amount
 
     try:
-        async with aiohttp.ClientSession() as session:
-            return await _estimate_with_session(
-                session,
-                resource_amount=resource_amount,
-                receiver=receiver,
-                duration_sec=duration,
-                unit_price=price,
-                allow_partial_fill=allow_partial,
-                min_delegate_amount=min_delegate,
-            )
+        return await _estimate(
+            resource_amount=resource_amount,
+            receiver=receiver,
+            duration_sec=duration,
+            unit_price=price,
+            allow_partial_fill=allow_partial,
+            min_delegate_amount=min_delegate,
+        )
     except Exception as exc:  # noqa: BLE001
         logger.exception("Failed to estimate buy-resource: %s", exc)
         return None
 
 
+def _fallback_package(package_id: int, amount: int) -> EnergyPackage:
+    return EnergyPackage(
+        id=package_id,
+        energy_amount=amount,
+        base_price_trx=_FALLBACK_PRICES_TRX[package_id - 1],
+        unit_price="MEDIUM",
+        is_fallback=True,
+    )
+
+
+async def _estimate_package(
+    package_id: int, amount: int, receiver_address: str, semaphore: asyncio.Semaphore
+) -> EnergyPackage:
+    async with semaphore:
+        estimate = await _estimate(
+            resource_amount=amount,
+            receiver=receiver_address,
+            duration_sec=settings.tronsave_duration_sec,
+            unit_price=settings.tronsave_unit_price,
+            allow_partial_fill=settings.tronsave_allow_partial_fill,
+            min_delegate_amount=settings.tronsave_min_delegate_amount,
+        )
+    return EnergyPackage(
+        id=package_id,
+        energy_amount=amount,
+        base_price_trx=(estimate.get("estimateTrx") or 0) / 1_000_000,
+        unit_price=estimate.get("unitPrice", settings.tronsave_unit_price),
+    )
+
+
 async def get_energy_packages(receiver_address: str) -> List[EnergyPackage]:
-    """Retrieve energy packages using tronsave.io estimates; fallback to defaults."""
+    """Estimate all presets concurrently; presets not priced by the deadline use fallback prices."""
     if not settings.tronsave_api_key:
         logger.warning("TRONSAVE_API_KEY is not configured; using fallback packages")
-        return [
-            EnergyPackage(id=i + 1, energy_amount=amt, base_price_trx=price, unit_price="MEDIUM")
-            for i, (amt, price) in enumerate(
-                zip(
-                    _ENERGY_PRESETS,
-                    [2.21, 4.45, 8.91, 13.36, 17.82, 22.27],
-                )
-            )
-        ]
+        return [_fallback_package(idx, amount) for idx, amount in enumerate(ENERGY_PRESETS, start=1)]
+
+    semaphore = asyncio.Semaphore(max(1, settings.tronsave_estimate_concurrency))
+    tasks = {
+        asyncio.create_task(_estimate_package(idx, amount, receiver_address, semaphore)): (idx, amount)
+        for idx, amount in enumerate(ENERGY_PRESETS, start=1)
+    }
+    done, pending = await asyncio.wait(tasks, timeout=settings.tronsave_estimate_deadline_sec)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning("%s package estimates missed the deadline; using fallback prices", len(pending))
 
     packages: list[EnergyPackage] = []
-    async with aiohttp.ClientSession() as session:
-        for idx, amount in enumerate(_ENERGY_PRESETS, start=1):
-            try:
-                estimate = await _estimate_with_session(
-                    session,
-                    resource_amount=amount,
-                    receiver=receiver_address,
-                    duration_sec=settings.tronsave_duration_sec,
-                    unit_price=settings.tronsave_unit_price,
-                    allow_partial_fill=settings.tronsave_allow_partial_fill,
-                    min_delegate_amount=settings.tronsave_min_delegate_amount,
-                )
-                estimate_trx = (estimate.get("estimateTrx") or 0) / 1_000_000
-                packages.append(
-                    EnergyPackage(
-                        id=idx,
-                        energy_amount=amount,
-                        base_price_trx=estimate_trx,
-                        unit_price=estimate.get("unitPrice", settings.tronsave_unit_price),
-                    )
-                )
-            except Exception:  # noqa: BLE001
-                logger.exception("Failed to estimate package for %s energy", amount)
-                continue
-
-    if not packages:
-        logger.warning("No packages could be estimated; falling back to defaults")
-        return [
-            EnergyPackage(id=i + 1, energy_amount=amt, base_price_trx=price, unit_price="MEDIUM")
-            for i, (amt, price) in enumerate(
-                zip(
-                    _ENERGY_PRESETS,
-                    [2.21, 4.45, 8.91, 13.36, 17.82, 22.27],
-                )
-            )
-        ]
+    for task, (idx, amount) in tasks.items():
+        if task in done and task.exception() is None:
+            packages.append(task.result())
+            continue
+        if task in done:
+            logger.error("Failed to estimate package for %s energy", amount, exc_info=task.exception())
+        packages.append(_fallback_package(idx, amount))
     return packages
 
 
+class OrderOutcomeUnknown(Exception):
+    """A buy-resource request may have reached tronsave.io, but no answer came back."""
+
+
+def _order_may_exist(exc: BaseException) -> bool:
+    if isinstance(exc, (aiohttp.ClientConnectorError, UpstreamUnavailable)):
+        return False
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status >= 500
+    return isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
 async def buy_resource(
     *,
     resource_amount: int,
@@ -212,7 +214,6 @@ async def buy_resource(
     max_price_accepted: int | None = None,
     prevent_duplicate_incomplete: bool = False,
 ) -> dict[str, Any] | None:
-    url = f"{settings.tronsave_api_base.rstrip('/')}/v2/buy-resource"
     payload: dict[str, Any] = {
         "resourceType": "ENERGY",
         "unitPrice": unit_price or settings.tronsave_unit_price,
@@ -233,13 +234,13 @@ async def buy_resource(
         payload["options"]["maxPriceAccepted"] = max_price_accepted
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                url, json=payload, headers=_headers(), timeout=aiohttp.ClientTimeout(total=20)
-            ) as resp:
-                resp.raise_for_status()
-                data = await resp.json()
-    except Exception:  # noqa: BLE001
+        data = await request_json(
+            TRONSAVE, "POST", "/v2/buy-resource", json=payload, headers=_headers(), timeout=BUY_RESOURCE_TIMEOUT_SEC
+        )
+    except Exception as exc:  # noqa: BLE001
+        if _order_may_exist(exc):
+            reason = f"HTTP {exc.status}" if isinstance(exc, aiohttp.ClientResponseError) else type(exc).__name__
+            raise OrderOutcomeUnknown(f"buy-resource for {receiver} got no answer ({reason})") from exc
         logger.exception("Failed to create buy-resource order")
         return None
 
@@ -249,21 +250,28 @@ async def buy_resource(
     return data.get("data")
 
 
+_ORDER_PATHS = ("/v2/orders/{order_id}", "/v2/order/{order_id}")
+_order_path: str | None = None
+
+
 async def get_order_details(order_id: str) -> dict[str, Any] | None:
-    base = settings.tronsave_api_base.rstrip("/")
-    paths = [f"{base}/v2/orders/{order_id}", f"{base}/v2/order/{order_id}"]
-    for url in paths:
+    """Fetch a buy-resource order, remembering which URL shape the API answers on."""
+    global _order_path
+    paths = [_order_path] if _order_path else []
+    paths += [template for template in _ORDER_PATHS if template != _order_path]
+    for template in paths:
+        path = template.format(order_id=order_id)
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=_headers(), timeout=aiohttp.ClientTimeout(total=15)) as resp:
-                    if resp.status == 404:
-                        continue
-                    resp.raise_for_status()
-                    data = await resp.json()
+            data = await request_json(TRONSAVE, "GET", path, headers=_headers(), timeout=15)
+        except aiohttp.ClientResponseError as exc:
+            if exc.status != 404:
+                logger.exception("Failed to fetch tronsave.io order details from %s", path)
+            continue
         except Exception:  # noqa: BLE001
-            logger.exception("Failed to fetch tronsave.io order details from %s", url)
+            logger.exception("Failed to fetch tronsave.io order details from %s", path)
             continue
 
+        _order_path = template
         if data.get("error"):
             logger.warning("tronsave.io order details error: %s", data.get("message"))
             return None
@@ -271,13 +279,19 @@ async def get_order_details(order_id: str) -> dict[str, Any] | None:
     return None
 
 
-async def delegate_energy(wallet_address: str, energy_amount: int) -> None:
-    """Delegate purchased energy to the target wallet via a buy-resource order."""
+async def delegate_energy(wallet_address: str, energy_amount: int) -> dict[str, Any] | None:
+    """Delegate purchased energy to the target wallet via a buy-resource order.
+
+    Returns the created order, or None when tronsave.io did not create one.
+    Raises ``OrderOutcomeUnknown`` when the order may or may not exist.
+    """
     order = await buy_resource(
         resource_amount=energy_amount,
         receiver=wallet_address,
+        prevent_duplicate_incomplete=True,
     )
     if not order:
         logger.error("Failed to create buy-resource order for %s", wallet_address)
-        return
+        return None
     logger.info("Created buy-resource order %s for %s energy to %s", order.get("orderId"), energy_amount, wallet_address)
+    return order
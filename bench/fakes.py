@@ -0,0 +1,183 @@
+"""Local stand-ins for TronGrid, tronsave.io and the Telegram Bot API.
+
+Each fake is a plain aiohttp app so benchmarks run offline with controllable
+latency, error rate and data volume.
+"""
+import asyncio
+import itertools
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import base58
+from aiohttp import web
+
+
+def random_address() -> str:
+    """A valid base58check TRON address."""
+    return base58.b58encode_check(b"\x41" + os.urandom(20)).decode()
+
+
+def address_hex(address: str) -> str:
+    return base58.b58decode_check(address).hex()
+
+
+@dataclass
+class UpstreamConfig:
+    latency_ms: float = 20.0
+    jitter_ms: float = 5.0
+    error_rate: float = 0.0
+    page_size: int = 200
+    order_book_levels: int = 50
+
+
+@dataclass
+class FakeChain:
+    """Incoming TRX transfers per receiver address, oldest first."""
+
+    transfers: Dict[str, List[dict]] = field(default_factory=dict)
+    _tx_ids: "itertools.count[int]" = field(default_factory=itertools.count)
+
+    def add_transfer(self, to_address: str, amount_sun: int, timestamp_ms: Optional[int] = None) -> str:
+        tx_id = f"{next(self._tx_ids):064x}"
+        self.transfers.setdefault(to_address, []).append(
+            {
+                "txID": tx_id,
+                "block_timestamp": timestamp_ms or int(time.time() * 1000),
+                "raw_data": {
+                    "contract": [
+                        {
+                            "type": "TransferContract",
+                            "parameter": {
+                                "value": {
+                                    "amount": amount_sun,
+                                    "owner_address": "41" + "00" * 20,
+                                    "to_address": address_hex(to_address),
+                                }
+                            },
+                        }
+                    ]
+                },
+            }
+        )
+        return tx_id
+
+
+def _fault_middleware(config: UpstreamConfig) -> Callable:
+    @web.middleware
+    async def middleware(request: web.Request, handler: Callable[[web.Request], Awaitable[web.StreamResponse]]):
+        delay = config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if config.error_rate and random.random() < config.error_rate:
+            return web.json_response({"error": True, "message": "injected failure"}, status=503)
+        return await handler(request)
+
+    return middleware
+
+
+def upstream_app(config: UpstreamConfig, chain: FakeChain) -> web.Application:
+    """Serve the TronGrid and tronsave.io endpoints the bot calls."""
+    order_ids = itertools.count(1)
+
+    async def account(request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "data": [
+                    {
+                        "balance": random.randint(0, 10_000) * 1_000_000,
+                        "trc20": [{"TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t": str(random.randint(0, 10**9))}],
+                    }
+                ]
+            }
+        )
+
+    async def resources(request: web.Request) -> web.Response:
+        return web.json_response(
+            {"data": [{"freeNetRemaining": 600, "netRemaining": 0, "energyRemaining": random.randint(0, 200_000)}]}
+        )
+
+    async def transactions(request: web.Request) -> web.Response:
+        txs = chain.transfers.get(request.match_info["address"], [])
+        min_ts = int(request.query.get("min_timestamp", 0))
+        limit = min(int(request.query.get("limit", config.page_size)), config.page_size)
+        offset = int(request.query.get("fingerprint") or 0)
+        visible = [tx for tx in txs if tx["block_timestamp"] >= min_ts]
+        page = visible[offset : offset + limit]
+        meta: dict = {"page_size": len(page)}
+        if offset + limit < len(visible):
+            meta["fingerprint"] = str(offset + limit)
+        return web.json_response({"data": page, "success": True, "meta": meta})
+
+    async def estimate(request: web.Request) -> web.Response:
+        body = await request.json()
+        amount = int(body.get("resourceAmount") or 0)
+        return web.json_response({"error": False, "data": {"estimateTrx": amount * 34, "unitPrice": 34}})
+
+    async def buy(request: web.Request) -> web.Response:
+        return web.json_response({"error": False, "data": {"orderId": f"bench-{next(order_ids)}"}})
+
+    async def order(request: web.Request) -> web.Response:
+        return web.json_response(
+            {"error": False, "data": {"id": request.match_info["order_id"], "fulfilledPercent": 100}}
+        )
+
+    async def order_book(request: web.Request) -> web.Response:
+        levels = [
+            {"price": 30 + idx, "availableResourceAmount": 200_000}
+            for idx in range(config.order_book_levels)
+        ]
+        return web.json_response({"error": False, "data": levels})
+
+    async def user_info(request: web.Request) -> web.Response:
+        return web.json_response({"error": False, "data": {"depositAddress": random_address(), "balance": 0}})
+
+    app = web.Application(middlewares=[_fault_middleware(config)])
+    app.router.add_get("/v1/accounts/{address}", account)
+    app.router.add_get("/v1/accounts/{address}/resources", resources)
+    app.router.add_get("/v1/accounts/{address}/transactions", transactions)
+    app.router.add_post("/v2/estimate-buy-resource", estimate)
+    app.router.add_post("/v2/buy-resource", buy)
+    app.router.add_get("/v2/orders/{order_id}", order)
+    app.router.add_get("/v2/order-book", order_book)
+    app.router.add_get("/v2/user-info", user_info)
+    return app
+
+
+def telegram_api_app(on_message: Callable[[int, str], None]) -> web.Application:
+    """A Bot API stand-in; ``on_message(chat_id, text)`` is called for every sendMessage."""
+    message_ids = itertools.count(1)
+
+    async def handle(request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        form = await request.post()
+        if method != "sendMessage":
+            return web.json_response({"ok": True, "result": True})
+
+        chat_id = int(form["chat_id"])
+        text = str(form.get("text", ""))
+        on_message(chat_id, text)
+        return web.json_response(
+            {
+                "ok": True,
+                "result": {
+                    "message_id": next(message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": text,
+                },
+            }
+        )
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", handle)
+    return app
+
+
+async def serve(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
@@ -0,0 +1,127 @@
+"""Replay a recorded cassette against the payment watcher and pricing code.
+
+Record production traffic with ``HTTP_CASSETTE_MODE=record`` and
+``HTTP_CASSETTE_PATH=busy-hour.jsonl.gz``, snapshot the database, then::
+
+    python -m bench.replay busy-hour.jsonl.gz --database snapshot.sqlite3 --ticks 200 --profile replay.prof
+
+The snapshot is copied first, so the original file is never modified.
+
+The watcher runs on a replay clock that starts when the recording started
+(``--start`` overrides it; old cassettes without wall-clock times fall back
+to the newest invoice in the snapshot) and moves on by the delay the watcher
+would have slept after each tick. With ``--recorded-timing`` those delays
+are actually slept, so ticks line up with the recorded responses; otherwise
+the clock advances without waiting.
+"""
+import argparse
+import asyncio
+import cProfile
+import logging
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from app import cassette, db
+from app.config import settings
+from app.http import close_http_clients, start_http_clients
+from app.payment import handle_pending_invoices, next_check_delay
+from app.pricing import price_packages, refresh_order_book
+from app.tronsave_client import ENERGY_PRESETS
+
+from .report import Result, print_results, save_results, summarize
+
+
+async def _clock_start(start: Optional[str]) -> datetime:
+    if start:
+        parsed = datetime.fromisoformat(start)
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    recorded = cassette.recording_started_at()
+    if recorded is not None:
+        return recorded
+    invoices = await db.get_pending_invoices()
+    if invoices:
+        return max(invoice.created_at for invoice in invoices)
+    return datetime.now(timezone.utc)
+
+
+async def run(args: argparse.Namespace) -> List[Result]:
+    settings.http_cassette_mode = "replay"
+    settings.http_cassette_path = args.cassette
+    settings.http_replay_timing = "recorded" if args.recorded_timing else "fast"
+    settings.simulate_payments = False
+    settings.metrics_port = 0
+    # Responses come from the cassette, so the TronGrid budget would only add idle time.
+    settings.tron_rate_per_key = settings.tron_rate_burst = 1_000_000.0
+    if args.database:
+        workdir = tempfile.mkdtemp(prefix="tgbot-replay-")
+        settings.database_path = os.path.join(workdir, "replay.sqlite3")
+        shutil.copyfile(args.database, settings.database_path)
+
+    await start_http_clients()
+    await db.init_db()
+    try:
+        now = await _clock_start(args.start)
+        ticks: List[float] = []
+        began = time.perf_counter()
+        for _ in range(args.ticks):
+            started = time.perf_counter()
+            open_invoices = await handle_pending_invoices(now)
+            ticks.append((time.perf_counter() - started) * 1000)
+            now += timedelta(milliseconds=(time.perf_counter() - started) * 1000)
+            delay = next_check_delay(open_invoices, int(now.timestamp() * 1000))
+            if delay is None:
+                delay = settings.payment_check_interval.total_seconds()
+            if args.recorded_timing:
+                await asyncio.sleep(delay)
+            now += timedelta(seconds=delay)
+        results = [summarize("replay_watcher_tick", ticks, time.perf_counter() - began)]
+
+        pricing: List[float] = []
+        began = time.perf_counter()
+        for _ in range(args.pricing_rounds):
+            started = time.perf_counter()
+            if await refresh_order_book():
+                price_packages(ENERGY_PRESETS)
+            pricing.append((time.perf_counter() - started) * 1000)
+        results.append(summarize("replay_order_book_pricing", pricing, time.perf_counter() - began))
+        return results
+    finally:
+        await db.close_db()
+        await close_http_clients()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("cassette")
+    parser.add_argument("--database", help="database snapshot taken while recording")
+    parser.add_argument("--ticks", type=int, default=100)
+    parser.add_argument("--pricing-rounds", type=int, default=100)
+    parser.add_argument(
+        "--recorded-timing",
+        action="store_true",
+        help="serve responses at their recorded offsets and sleep between watcher ticks",
+    )
+    parser.add_argument("--start", help="ISO time the replay clock starts at (default: recording start)")
+    parser.add_argument("--profile", help="write cProfile stats to this file")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    results = asyncio.run(run(args))
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+    print_results(results)
+    if args.output:
+        save_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
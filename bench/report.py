@@ -0,0 +1,75 @@
+import json
+import math
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Sequence
+
+
+@dataclass
+class Result:
+    name: str
+    count: int
+    errors: int
+    elapsed_sec: float
+    p50_ms: float
+    p99_ms: float
+    max_ms: float
+
+    @property
+    def throughput(self) -> float:
+        return self.count / self.elapsed_sec if self.elapsed_sec > 0 else 0.0
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(name: str, latencies_ms: List[float], elapsed_sec: float, errors: int = 0) -> Result:
+    values = sorted(latencies_ms)
+    return Result(
+        name=name,
+        count=len(values),
+        errors=errors,
+        elapsed_sec=elapsed_sec,
+        p50_ms=percentile(values, 50),
+        p99_ms=percentile(values, 99),
+        max_ms=values[-1] if values else 0.0,
+    )
+
+
+def print_results(results: List[Result]) -> None:
+    print(f"{'scenario':<28}{'count':>8}{'errors':>8}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for r in results:
+        print(
+            f"{r.name:<28}{r.count:>8}{r.errors:>8}{r.throughput:>10.1f}"
+            f"{r.p50_ms:>10.2f}{r.p99_ms:>10.2f}{r.max_ms:>10.2f}"
+        )
+
+
+def save_results(results: List[Result], path: str) -> None:
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump([asdict(r) for r in results], fh, indent=2)
+
+
+def find_regressions(
+    results: List[Result], baseline_path: str, tolerance_percent: float, min_delta_ms: float = 1.0
+) -> List[str]:
+    """Compare p99 latencies with a saved run; return a line per scenario that got slower.
+
+    Increases below ``min_delta_ms`` are ignored so sub-millisecond scenarios
+    do not flap.
+    """
+    with open(baseline_path, encoding="utf-8") as fh:
+        baseline: Dict[str, dict] = {item["name"]: item for item in json.load(fh)}
+    regressions: List[str] = []
+    for r in results:
+        before = baseline.get(r.name)
+        if not before or before["p99_ms"] <= 0:
+            continue
+        limit = before["p99_ms"] * (1 + tolerance_percent / 100)
+        if r.p99_ms > limit and r.p99_ms - before["p99_ms"] >= min_delta_ms:
+            regressions.append(f"{r.name}: p99 {r.p99_ms:.2f} ms vs baseline {before['p99_ms']:.2f} ms")
+    return regressions
@@ -0,0 +1,319 @@
+"""Offline benchmarks against local TronGrid, tronsave.io and Bot API stand-ins.
+
+    python -m bench.run --scenarios pending,packages,balances,handlers \\
+        --invoices 10000 --users 1000 --latency-ms 20 --error-rate 0.01
+
+Results can be saved with ``--output`` and compared with an earlier run via
+``--baseline``; the exit status is 1 when any p99 regressed beyond
+``--tolerance`` percent.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import ClientSession
+
+from app import db, tron_client
+from app.config import settings
+from app.http import close_http_clients, start_http_clients
+from app.keyboards import ENTER_ADDRESS
+from app.payment import handle_pending_invoices
+from app.pricing import price_packages, refresh_order_book
+from app.tronsave_client import ENERGY_PRESETS, get_energy_packages
+
+from .fakes import FakeChain, UpstreamConfig, random_address, serve, telegram_api_app, upstream_app
+from .report import Result, find_regressions, print_results, save_results, summarize
+
+TOKEN = "123456:BENCHMARK"
+SECRET = "bench-secret"
+
+
+async def _timed_calls(
+    count: int, concurrency: int, call: Callable[[int], Awaitable[object]]
+) -> tuple[List[float], float, int]:
+    """Run ``call(i)`` for ``i < count`` with bounded concurrency; return latencies, elapsed, errors."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await call(i)
+            except Exception:  # noqa: BLE001
+                errors += 1
+                return
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    began = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return latencies, time.perf_counter() - began, errors
+
+
+async def _fresh_db(workdir: str, name: str) -> None:
+    await db.close_db()
+    settings.database_path = os.path.join(workdir, f"{name}.sqlite3")
+    await db.init_db()
+
+
+async def scenario_pending(args: argparse.Namespace, chain: FakeChain, workdir: str) -> List[Result]:
+    """Create many open invoices on one receiver, pay a share of them and time watcher ticks."""
+    await _fresh_db(workdir, "pending")
+    receiver = random_address()
+    settings.simulate_payments = False
+    settings.payment_receiver_address = receiver
+    settings.payment_amount_max_offsets = max(settings.payment_amount_max_offsets, 100)
+    settings.tron_ingest_max_pages = args.invoices // max(1, args.page_size) + 2
+
+    invoices: List[db.Invoice] = []
+
+    async def create(i: int) -> None:
+        final_price_sun = random.randint(1, 50) * 1_000_000 + random.randint(0, 999) * 1_000
+        invoices.append(
+            await db.create_invoice(
+                user_id=i,
+                wallet_address=random_address(),
+                energy_amount=random.choice(ENERGY_PRESETS),
+                base_price_sun=final_price_sun,
+                final_price_sun=final_price_sun,
+                unique_payment_address=receiver,
+            )
+        )
+
+    latencies, elapsed, errors = await _timed_calls(args.invoices, args.concurrency, create)
+    results = [summarize("create_invoice", latencies, elapsed, errors)]
+
+    paid = random.sample(invoices, int(len(invoices) * args.paid_ratio))
+    for invoice in paid:
+        chain.add_transfer(receiver, invoice.payable_amount_sun, invoice.created_at_ms + 1_000)
+
+    ticks: List[float] = []
+    began = time.perf_counter()
+    for _ in range(args.ticks):
+        started = time.perf_counter()
+        await handle_pending_invoices()
+        ticks.append((time.perf_counter() - started) * 1000)
+    elapsed = time.perf_counter() - began
+    results.append(summarize("pending_tick_first", ticks[:1], ticks[0] / 1000 if ticks else 0))
+    results.append(summarize("pending_tick_steady", ticks[1:], elapsed - (ticks[0] / 1000 if ticks else 0)))
+
+    still_open = len(await db.get_pending_invoices())
+    print(f"pending: {len(invoices)} invoices, {len(paid)} paid on chain, {still_open} still open")
+    return results
+
+
+async def scenario_packages(args: argparse.Namespace, chain: FakeChain, workdir: str) -> List[Result]:
+    """Time live package estimates and local order-book pricing."""
+    settings.tronsave_api_key = "bench"
+    latencies, elapsed, errors = await _timed_calls(
+        args.users, args.concurrency, lambda i: get_energy_packages(random_address())
+    )
+    results = [summarize("get_energy_packages", latencies, elapsed, errors)]
+
+    if not await refresh_order_book():
+        print("packages: order book refresh failed; skipping local pricing")
+        return results
+    local: List[float] = []
+    began = time.perf_counter()
+    for _ in range(args.users):
+        started = time.perf_counter()
+        price_packages(ENERGY_PRESETS)
+        local.append((time.perf_counter() - started) * 1000)
+    results.append(summarize("price_packages_local", local, time.perf_counter() - began))
+    return results
+
+
+async def scenario_balances(args: argparse.Namespace, chain: FakeChain, workdir: str) -> List[Result]:
+    """Time balance lookups for distinct wallets, cold and then cached."""
+    addresses = [random_address() for _ in range(args.users)]
+    tron_client._balances.clear()
+    results = []
+    for name in ("get_tron_balances_cold", "get_tron_balances_warm"):
+        latencies, elapsed, errors = await _timed_calls(
+            len(addresses), args.concurrency, lambda i: tron_client.get_tron_balances(addresses[i])
+        )
+        results.append(summarize(name, latencies, elapsed, errors))
+    return results
+
+
+def _callback_update(update_id: int, chat_id: int, data: str) -> dict:
+    user = {"id": chat_id, "is_bot": False, "first_name": "Bench"}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": "menu",
+            },
+        },
+    }
+
+
+def _text_update(update_id: int, chat_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "text": text,
+        },
+    }
+
+
+async def scenario_handlers(args: argparse.Namespace, chain: FakeChain, workdir: str) -> List[Result]:
+    """Concurrent users enter a wallet address and wait for the package list, end to end."""
+    import bot as bot_module
+
+    await db.close_db()
+    await close_http_clients()
+    settings.database_path = os.path.join(workdir, "handlers.sqlite3")
+    settings.webhook_base_url = f"http://127.0.0.1:{args.webhook_port}"
+    settings.webhook_secret = SECRET
+    settings.tronsave_api_key = "bench"
+    tron_client._balances.clear()
+
+    inboxes: Dict[int, "asyncio.Queue[str]"] = {}
+
+    def on_message(chat_id: int, text: str) -> None:
+        inboxes.setdefault(chat_id, asyncio.Queue()).put_nowait(text)
+
+    api_runner = await serve(telegram_api_app(on_message), args.telegram_port)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{args.telegram_port}"))
+    bot = Bot(token=TOKEN, session=session)
+    dp = bot_module.create_dispatcher()
+    webhook_runner = await serve(bot_module.create_webhook_app(bot, dp), args.webhook_port)
+    url = f"{settings.webhook_base_url}{settings.webhook_path}"
+
+    async def wait_for(chat_id: int, prefix: str) -> None:
+        inbox = inboxes.setdefault(chat_id, asyncio.Queue())
+        while not (await asyncio.wait_for(inbox.get(), timeout=60)).startswith(prefix):
+            pass
+
+    try:
+        async with ClientSession(headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as client:
+
+            async def user_flow(i: int) -> None:
+                chat_id = 100_000 + i
+                async with client.post(url, json=_callback_update(2 * i + 1, chat_id, ENTER_ADDRESS)) as resp:
+                    resp.raise_for_status()
+                await wait_for(chat_id, "Please enter")
+                async with client.post(url, json=_text_update(2 * i + 2, chat_id, random_address())) as resp:
+                    resp.raise_for_status()
+                await wait_for(chat_id, "🔋")
+
+            latencies, elapsed, errors = await _timed_calls(args.users, args.concurrency, user_flow)
+    finally:
+        await webhook_runner.cleanup()
+        await api_runner.cleanup()
+        current = asyncio.current_task()
+        leftovers = [task for task in asyncio.all_tasks() if task is not current]
+        for task in leftovers:
+            task.cancel()
+        await asyncio.gather(*leftovers, return_exceptions=True)
+    return [summarize("handler_address_to_packages", latencies, elapsed, errors)]
+
+
+SCENARIOS = {
+    "pending": scenario_pending,
+    "packages": scenario_packages,
+    "balances": scenario_balances,
+    "handlers": scenario_handlers,
+}
+
+
+async def run(args: argparse.Namespace) -> List[Result]:
+    workdir = tempfile.mkdtemp(prefix="tgbot-bench-")
+    config = UpstreamConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        page_size=args.page_size,
+    )
+    chain = FakeChain()
+    upstream_runner = await serve(upstream_app(config, chain), args.upstream_port)
+    upstream_url = f"http://127.0.0.1:{args.upstream_port}"
+    settings.tron_api_base = upstream_url
+    settings.tronsave_api_base = upstream_url
+    settings.tron_api_key = ""
+    settings.tron_api_keys = ""
+    settings.tron_rate_per_key = args.tron_rate
+    settings.tron_rate_burst = args.tron_rate
+    settings.tron_ingest_page_size = args.page_size
+    settings.deposit_address_pool_file = ""
+    settings.metrics_port = 0
+
+    results: List[Result] = []
+    try:
+        await start_http_clients()
+        settings.database_path = os.path.join(workdir, "bench.sqlite3")
+        await db.init_db()
+        for name in args.scenarios:
+            results.extend(await SCENARIOS[name](args, chain, workdir))
+    finally:
+        await close_http_clients()
+        await db.close_db()
+        await upstream_runner.cleanup()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default="pending,packages,balances,handlers")
+    parser.add_argument("--invoices", type=int, default=10_000)
+    parser.add_argument("--paid-ratio", type=float, default=0.1)
+    parser.add_argument("--ticks", type=int, default=5)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument(
+        "--tron-rate", type=float, default=10_000.0, help="TronGrid requests per second (the fakes never throttle)"
+    )
+    parser.add_argument("--upstream-port", type=int, default=8191)
+    parser.add_argument("--telegram-port", type=int, default=8192)
+    parser.add_argument("--webhook-port", type=int, default=8193)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare p99 against")
+    parser.add_argument("--tolerance", type=float, default=20.0, help="allowed p99 increase in percent")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    logging.getLogger().setLevel(logging.WARNING)
+    results = asyncio.run(run(args))
+    print_results(results)
+    if args.output:
+        save_results(results, args.output)
+    if args.baseline:
+        regressions = find_regressions(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
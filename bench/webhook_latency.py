@@ -0,0 +1,112 @@
+"""Measure end-to-end webhook latency against a stub Telegram Bot API.
+
+Starts the bot's webhook app and a fake Bot API server on localhost, posts
+synthetic ``/start`` updates and times each one from the webhook POST until
+the handler's reply reaches the fake API::
+
+    python -m bench.webhook_latency --updates 500 --concurrency 50
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from typing import Dict
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import ClientSession
+
+import bot as bot_module
+from app.config import settings
+
+from .fakes import serve, telegram_api_app
+from .report import print_results, summarize
+
+TOKEN = "123456:BENCHMARK"
+SECRET = "bench-secret"
+
+
+def _update(update_id: int, chat_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+
+async def run(updates: int, concurrency: int, api_port: int, webhook_port: int) -> None:
+    workdir = tempfile.mkdtemp(prefix="webhook-bench-")
+    settings.database_path = os.path.join(workdir, "bench.sqlite3")
+    settings.webhook_base_url = f"http://127.0.0.1:{webhook_port}"
+    settings.webhook_secret = SECRET
+    settings.tronsave_api_key = ""
+    settings.deposit_address_pool_file = ""
+
+    settings.metrics_port = 0
+
+    loop = asyncio.get_running_loop()
+    replies: Dict[int, "asyncio.Future[float]"] = {}
+
+    def on_message(chat_id: int, text: str) -> None:
+        future = replies.get(chat_id)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    api_runner = await serve(telegram_api_app(on_message), api_port)
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{api_port}"))
+    bot = Bot(token=TOKEN, session=session)
+    dp = bot_module.create_dispatcher()
+    dp.startup.register(bot_module.on_webhook_startup)
+    webhook_runner = await serve(bot_module.create_webhook_app(bot, dp), webhook_port)
+
+    url = f"{settings.webhook_base_url}{settings.webhook_path}"
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with ClientSession(headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as client:
+        async with client.post(url, json=_update(0, 1), headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as resp:
+            print(f"wrong secret -> HTTP {resp.status}")
+
+        async def send(update_id: int) -> None:
+            chat_id = 10_000 + update_id
+            replies[chat_id] = loop.create_future()
+            async with semaphore:
+                started = time.perf_counter()
+                async with client.post(url, json=_update(update_id, chat_id)) as resp:
+                    resp.raise_for_status()
+                replied = await asyncio.wait_for(replies[chat_id], timeout=30)
+            latencies.append((replied - started) * 1000)
+
+        began = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(1, updates + 1)))
+        elapsed = time.perf_counter() - began
+
+    await webhook_runner.cleanup()
+    await api_runner.cleanup()
+
+    print_results([summarize("webhook_start", latencies, elapsed)])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--api-port", type=int, default=8181)
+    parser.add_argument("--webhook-port", type=int, default=8182)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args.updates, args.concurrency, args.api_port, args.webhook_port))
+
+
+if __name__ == "__main__":
+    main()
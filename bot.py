@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import math
 import re
 from typing import Any
 
@@ -7,9 +8,15 @@ from aiogram import Bot, Dispatcher, F, Router
 from aiogram.filters import CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
-from app import db
+from app import db, metrics
+from app.archive import maintenance_loop
 from app.config import settings
+from app.delegation import start_delegation_workers, stop_delegation_workers
+from app.fsm_storage import SQLiteStorage
+from app.http import close_http_clients, start_http_clients
 from app.keyboards import (
     BUY_ENERGY,
     BUY_ENERGY_START_KB,
@@ -20,14 +27,25 @@ from app.keyboards import (
     PROVIDE_ENERGY,
     WALLET_CONNECT,
     energy_packages_kb,
+    payment_currency_kb,
 )
-from app.payment import payment_watcher
+from app.lease import run_as_leader
+from app.notifier import outbox_sender
+from app.orders import order_tracker
+from app.payment import init_deposit_pool, notify_new_invoice, payment_watcher
+from app.pricing import get_packages, order_book_refresher, verify_package_price
+from app.quotes import get_quote, save_quote
+from app.rates import rate_refresher, sun_to_usdt_units, trx_usdt_rate
 from app.states import BuyEnergyStates, ProvideEnergyStates
 from app.tron_client import get_tron_balances
-from app.tronsave_client import EnergyPackage, get_account_info, get_energy_packages
+from app.tronsave_client import EnergyPackage, get_account_info
 
 logger = logging.getLogger(__name__)
 router = Router()
+router.message.middleware(metrics.HandlerMetricsMiddleware())
+router.callback_query.middleware(metrics.HandlerMetricsMiddleware())
+_leader_task: asyncio.Task | None = None
+_refresher_tasks: list[asyncio.Task] = []
 
 
 TRON_ADDRESS_REGEX = re.compile(r"^T[1-9A-HJ-NP-Za-km-z]{25,33}$")
@@ -43,9 +61,19 @@ def format_wallet_info(address: str, balances: dict[str, Any]) -> str:
     )
 
 
+def format_amount(amount_sun: int) -> str:
+    """Render a six-decimal amount (SUN or 10^-6 USDT) with every significant decimal kept."""
+    text = f"{amount_sun / 1_000_000:.6f}".rstrip("0")
+    whole, _, decimals = text.partition(".")
+    return f"{whole}.{decimals.ljust(2, '0')}"
+
+
 def format_package_label(pkg: EnergyPackage) -> str:
     final_price = pkg.base_price_trx * (1 + settings.commission_percent / 100)
-    return f"{pkg.energy_amount:,} ⚡ — {final_price:.2f} TRX"
+    label = f"{pkg.energy_amount:,} ⚡ — {final_price:.2f} TRX"
+    if pkg.is_fallback:
+        label += " (est.)"
+    return label
 
 
 async def send_main_menu(message: Message) -> None:
@@ -110,59 +138,136 @@ async def receive_wallet_address(message: Message, state: FSMContext) -> None:
     balances = await get_tron_balances(address)
     await message.answer(format_wallet_info(address, balances))
 
-    packages = await get_energy_packages(address)
+    packages = await get_packages(address)
+    quote = await save_quote(address, packages)
     labeled_packages = [(pkg.id, format_package_label(pkg)) for pkg in packages]
     await message.answer(
         "🔋 Available Energy Packages",
-        reply_markup=energy_packages_kb(labeled_packages),
+        reply_markup=energy_packages_kb(quote.id, labeled_packages),
     )
 
 
+async def _selected_package(
+    callback: CallbackQuery, quote_id: str, pkg_id: str
+) -> tuple[str, EnergyPackage] | None:
+    """Load the wallet and package a keyboard button refers to, answering the user if it is gone."""
+    quote = await get_quote(quote_id) if pkg_id.isdigit() else None
+    if quote is None:
+        await callback.message.answer(
+            "These prices have expired. Please enter your wallet address again to get fresh ones."
+        )
+        await callback.answer()
+        return None
+
+    pkg = quote.packages.get(int(pkg_id))
+    if not pkg:
+        await callback.message.answer("Selected package not found. Please try again.")
+        await callback.answer()
+        return None
+    return quote.wallet_address, pkg
+
+
 @router.callback_query(F.data.startswith("pkg:"))
 async def handle_package_selection(callback: CallbackQuery, state: FSMContext) -> None:
-    data = await state.get_data()
-    wallet_address = data.get("wallet_address")
-    if not wallet_address:
-        await callback.message.answer("Please provide a wallet address first.")
+    quote_id, _, pkg_id = callback.data.removeprefix("pkg:").partition(":")
+    selected = await _selected_package(callback, quote_id, pkg_id)
+    if selected is None:
+        return
+    wallet_address, pkg = selected
+
+    rate = trx_usdt_rate() if settings.usdt_payments_enabled else None
+    if rate is not None:
+        final_price_trx = pkg.base_price_trx * (1 + settings.commission_percent / 100)
+        await callback.message.answer(
+            "💳 How would you like to pay?",
+            reply_markup=payment_currency_kb(
+                quote_id,
+                pkg.id,
+                [
+                    (db.TRX, f"🔺 {final_price_trx:.2f} TRX"),
+                    (db.USDT, f"💵 {final_price_trx * rate:.2f} USDT (TRC20)"),
+                ],
+            ),
+        )
         await callback.answer()
         return
+    await _issue_invoice(callback, wallet_address, pkg, db.TRX)
 
-    package_id = int(callback.data.split(":", maxsplit=1)[1])
-    packages = {pkg.id: pkg for pkg in await get_energy_packages(wallet_address)}
-    pkg = packages.get(package_id)
-    if not pkg:
-        await callback.message.answer("Selected package not found. Please try again.")
+
+@router.callback_query(F.data.startswith("cur:"))
+async def handle_currency_selection(callback: CallbackQuery, state: FSMContext) -> None:
+    parts = callback.data.split(":")
+    if len(parts) != 4 or parts[3] not in (db.TRX, db.USDT):
+        await callback.answer()
+        return
+    selected = await _selected_package(callback, parts[1], parts[2])
+    if selected is None:
+        return
+    wallet_address, pkg = selected
+    await _issue_invoice(callback, wallet_address, pkg, parts[3])
+
+
+async def _issue_invoice(callback: CallbackQuery, wallet_address: str, pkg: EnergyPackage, currency: str) -> None:
+    if settings.pricing_verify_on_invoice and not await verify_package_price(pkg, wallet_address):
+        await callback.message.answer(
+            "Prices have moved since this list was shown. Please enter your wallet address again to get fresh ones."
+        )
         await callback.answer()
         return
 
-    commission_multiplier = 1 + settings.commission_percent / 100
-    final_price = pkg.base_price_trx * commission_multiplier
-    if not settings.payment_receiver_address:
+    base_price_sun = round(pkg.base_price_trx * 1_000_000)
+    if currency == db.USDT:
+        rate = trx_usdt_rate()
+        if rate is None:
+            await callback.message.answer(
+                "USDT payments are unavailable right now. Please pay in TRX or try again later."
+            )
+            await callback.answer()
+            return
+        base_price_sun = sun_to_usdt_units(base_price_sun, rate)
+    final_price_sun = math.ceil(base_price_sun * (1 + settings.commission_percent / 100))
+    if settings.deposit_address_pool_file:
+        unique_payment_address = None
+    elif settings.payment_receiver_address:
+        unique_payment_address = settings.payment_receiver_address
+    else:
         await callback.message.answer(
             "Payment receiving address is not configured. Please try again later."
         )
         await callback.answer()
         return
-    unique_payment_address = settings.payment_receiver_address
-
-    invoice = await db.create_invoice(
-        user_id=callback.from_user.id,
-        wallet_address=wallet_address,
-        energy_amount=pkg.energy_amount,
-        base_price_trx=pkg.base_price_trx,
-        final_price_trx=final_price,
-        unique_payment_address=unique_payment_address,
-    )
 
+    try:
+        invoice = await db.create_invoice(
+            user_id=callback.from_user.id,
+            wallet_address=wallet_address,
+            energy_amount=pkg.energy_amount,
+            base_price_sun=base_price_sun,
+            final_price_sun=final_price_sun,
+            unique_payment_address=unique_payment_address,
+            currency=currency,
+        )
+    except RuntimeError:
+        logger.exception("Unable to allocate a payment target for user %s", callback.from_user.id)
+        await callback.message.answer(
+            "Too many invoices are open right now. Please try again in a few minutes."
+        )
+        await callback.answer()
+        return
+    metrics.INVOICE_EVENTS.inc(status="created")
+    notify_new_invoice()
+
+    pay_to = "USDT TRC20 address" if invoice.currency == db.USDT else "TRX address"
     expires_local = invoice.expires_at.astimezone().strftime("%Y-%m-%d %H:%M:%S %Z")
     await callback.message.answer(
         (
             f"🧾 INVOICE #{invoice.id}\n\n"
             f"⚡ Energy: {invoice.energy_amount:,}\n"
-            f"💵 Amount: {invoice.final_price_trx:.2f} TRX\n"
+            f"💵 Amount: {format_amount(invoice.payable_amount_sun)} {invoice.currency}\n"
             f"⏳ Valid until: {expires_local}\n"
-            "🏦 Pay to (TRX address):\n"
+            f"🏦 Pay to ({pay_to}):\n"
             f"{invoice.unique_payment_address}\n\n"
+            "⚠️ Send exactly this amount in a single transfer so we can match your payment.\n"
             "We will automatically check for payment."
         )
     )
@@ -236,7 +341,12 @@ async def receive_provider_address(message: Message, state: FSMContext) -> None:
 
 
 async def on_startup(bot: Bot) -> None:
+    global _leader_task
     await db.init_db()
+    await start_http_clients()
+    metrics.add_collector(db.collect_queue_depths)
+    await metrics.start_metrics_server()
+    await init_deposit_pool()
     if not settings.payment_receiver_address and settings.tronsave_api_key:
         info = await get_account_info()
         deposit = (info or {}).get("depositAddress") if info else None
@@ -245,7 +355,87 @@ async def on_startup(bot: Bot) -> None:
             logger.info("Using tronsave.io deposit address for payments")
         else:
             logger.warning("Unable to determine payment receiver address from tronsave.io")
-    asyncio.create_task(payment_watcher(bot))
+    # Loops that must not run twice across replicas follow the leader lease;
+    # delegation workers claim jobs atomically and run everywhere.
+    _leader_task = asyncio.create_task(
+        run_as_leader(
+            "background",
+            lambda: outbox_sender(bot),
+            payment_watcher,
+            order_tracker,
+            maintenance_loop,
+        )
+    )
+    start_delegation_workers()
+    if settings.pricing_engine_enabled and settings.tronsave_api_key:
+        _refresher_tasks.append(asyncio.create_task(order_book_refresher()))
+    if settings.usdt_payments_enabled and settings.trx_usdt_rate <= 0:
+        _refresher_tasks.append(asyncio.create_task(rate_refresher()))
+
+
+async def on_shutdown(bot: Bot) -> None:
+    if _leader_task is not None:
+        _leader_task.cancel()
+        await asyncio.gather(_leader_task, return_exceptions=True)
+    await stop_delegation_workers()
+    for task in _refresher_tasks:
+        task.cancel()
+    await asyncio.gather(*_refresher_tasks, return_exceptions=True)
+    _refresher_tasks.clear()
+    await metrics.stop_metrics_server()
+    await close_http_clients()
+    await db.close_db()
+
+
+async def on_webhook_startup(bot: Bot, dispatcher: Dispatcher) -> None:
+    await bot.set_webhook(
+        f"{settings.webhook_base_url}{settings.webhook_path}",
+        secret_token=settings.webhook_secret or None,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+    )
+    logger.info("Webhook registered at %s%s", settings.webhook_base_url, settings.webhook_path)
+
+
+def create_dispatcher() -> Dispatcher:
+    dp = Dispatcher(storage=SQLiteStorage() if settings.fsm_storage == "sqlite" else None)
+    dp.include_router(router)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
+def create_webhook_app(bot: Bot, dp: Dispatcher) -> web.Application:
+    """Build the aiohttp app that feeds Telegram webhook updates into ``dp``.
+
+    Requests without the configured ``X-Telegram-Bot-Api-Secret-Token`` are
+    rejected before they reach any handler.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=settings.webhook_secret or None,
+    ).register(app, path=settings.webhook_path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    if not settings.webhook_base_url:
+        raise RuntimeError("WEBHOOK_BASE_URL must be set when BOT_MODE=webhook")
+    if not settings.webhook_secret:
+        logger.warning("WEBHOOK_SECRET is not set; webhook requests are not authenticated")
+
+    dp.startup.register(on_webhook_startup)
+    runner = web.AppRunner(create_webhook_app(bot, dp))
+    await runner.setup()
+    site = web.TCPSite(runner, settings.webhook_host, settings.webhook_port)
+    await site.start()
+    logger.info("Serving webhook on %s:%s", settings.webhook_host, settings.webhook_port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 
 async def main() -> None:
@@ -253,11 +443,14 @@ async def main() -> None:
         raise RuntimeError("BOT_TOKEN must be set in the environment")
 
     bot = Bot(token=settings.bot_token)
-    dp = Dispatcher()
-    dp.include_router(router)
-    dp.startup.register(on_startup)
+    dp = create_dispatcher()
+
+    if settings.bot_mode == "webhook":
+        await run_webhook(bot, dp)
+        return
 
     logger.info("Starting bot polling")
+    await bot.delete_webhook()
     await dp.start_polling(bot)
 
 